@@ -0,0 +1,314 @@
+"""Benchmarks for the screen and rendering hot paths.
+
+Each workload is a synthetic, full-screen operation on `Screen` or on an
+offscreen `GtkUI`, and is timed with every available build of the screen
+module: the pure python source and, if `setup.py` Cythonized it, the
+compiled extension. Run it with:
+
+    python -m neovim_gui.benchmark [--json PATH] [--baseline PATH]
+
+With `--json`, results are written as JSON which can later be passed as
+`--baseline`. The exit status is 1 if any benchmark got slower than its
+baseline by more than `--threshold`(a fraction of the baseline time).
+
+The `gtk.*` workloads need a display and are skipped without one.
+"""
+import json
+import os
+import platform
+import sys
+from timeit import default_timer
+
+import click
+
+from neovim.compat import IS_PYTHON3
+
+from . import screen as screen_module
+
+
+if not IS_PYTHON3:
+    range = xrange  # NOQA
+
+
+__all__ = ('run_benchmarks', 'compare')
+
+
+ATTRS = [
+    None,
+    {'foreground': 0xff0000},
+    {'foreground': 0x00ff00, 'bold': True},
+    {'background': 0x0000ff, 'italic': True},
+    {'foreground': 0xffff00, 'underline': True},
+]
+TEXT = 'The quick brown fox jumps over the lazy dog. '
+
+
+def _row_cells(columns):
+    """Return the text and attributes of a row with a mix of highlights."""
+    texts = [TEXT[col % len(TEXT)] for col in range(columns)]
+    attrs = [ATTRS[(col // 7) % len(ATTRS)] for col in range(columns)]
+    return texts, attrs
+
+
+def _fill(screen, columns, rows):
+    texts, attrs = _row_cells(columns)
+    for row in range(rows):
+        screen.cursor_goto(row, 0)
+        for col in range(columns):
+            screen.put(texts[col], attrs[col])
+
+
+def _screen_put(screen_cls, columns, rows):
+    screen = screen_cls(columns, rows)
+
+    def run():
+        _fill(screen, columns, rows)
+    return run
+
+
+def _screen_scroll(count, split):
+    def workload(screen_cls, columns, rows):
+        screen = screen_cls(columns, rows)
+        _fill(screen, columns, rows)
+        if split:
+            # left window of a vertical split, above the statusline
+            screen.set_scroll_region(0, rows - 2, 0, columns // 2 - 1)
+        else:
+            screen.set_scroll_region(0, rows - 1, 0, columns - 1)
+
+        def run():
+            for _ in range(rows):
+                screen.scroll(count)
+        return run
+    return workload
+
+
+def _screen_eol_clear(screen_cls, columns, rows):
+    screen = screen_cls(columns, rows)
+
+    def run():
+        for row in range(rows):
+            screen.cursor_goto(row, columns // 4)
+            screen.eol_clear()
+    return run
+
+
+def _screen_iter(screen_cls, columns, rows):
+    screen = screen_cls(columns, rows)
+    _fill(screen, columns, rows)
+
+    def run():
+        for row in range(rows):
+            for _ in screen.iter(row, row, 0, columns - 1):
+                pass
+    return run
+
+
+class _Bridge(object):
+    tracer = None
+
+
+def _gtk_ui(screen_cls, columns, rows):
+    from gi.repository import Gtk
+    from .gtk_ui import GtkUI
+    if not Gtk.init_check(sys.argv)[0]:
+        return None
+    ui = GtkUI(max_fps=0)
+    ui._bridge = _Bridge()
+    ui._drawing_area = Gtk.DrawingArea()
+    ui._window = Gtk.OffscreenWindow()
+    ui._window.add(ui._drawing_area)
+    ui._window.show_all()
+    ui._nvim_resize(columns, rows)
+    ui._screen = screen_cls(columns, rows)
+    return ui
+
+
+def _gtk_fill(ui, columns, rows):
+    texts, attrs = _row_cells(columns)
+    texts = [ui._get_pango_text(text) for text in texts]
+    for row in range(rows):
+        ui._nvim_cursor_goto(row, 0)
+        for col in range(columns):
+            ui._nvim_highlight_set(attrs[col])
+            ui._nvim_put(texts[col])
+    ui._flush()
+
+
+def _gtk_flush(screen_cls, columns, rows):
+    ui = _gtk_ui(screen_cls, columns, rows)
+    if not ui:
+        return None
+
+    def run():
+        _gtk_fill(ui, columns, rows)
+    return run
+
+
+def _gtk_scroll(screen_cls, columns, rows):
+    ui = _gtk_ui(screen_cls, columns, rows)
+    if not ui:
+        return None
+    _gtk_fill(ui, columns, rows)
+    ui._nvim_set_scroll_region(0, rows - 1, 0, columns - 1)
+
+    def run():
+        for _ in range(rows):
+            ui._nvim_scroll(1)
+    return run
+
+
+def _gtk_draw(screen_cls, columns, rows):
+    import cairo
+    ui = _gtk_ui(screen_cls, columns, rows)
+    if not ui:
+        return None
+    _gtk_fill(ui, columns, rows)
+    surface = cairo.ImageSurface(cairo.FORMAT_RGB24, ui._pixel_width,
+                                 ui._pixel_height)
+    cr = cairo.Context(surface)
+
+    def run():
+        for _ in range(10):
+            ui._gtk_draw(None, cr)
+    return run
+
+
+WORKLOADS = [
+    ('screen.put', _screen_put),
+    ('screen.scroll_up', _screen_scroll(1, False)),
+    ('screen.scroll_down', _screen_scroll(-1, False)),
+    ('screen.scroll_split_up', _screen_scroll(1, True)),
+    ('screen.scroll_split_down', _screen_scroll(-1, True)),
+    ('screen.eol_clear', _screen_eol_clear),
+    ('screen.iter', _screen_iter),
+    ('gtk.flush', _gtk_flush),
+    ('gtk.scroll', _gtk_scroll),
+    ('gtk.draw', _gtk_draw),
+]
+
+
+def screen_builds():
+    """Return the available builds of the screen module by name."""
+    path = screen_module.__file__
+    if path.endswith(('.py', '.pyc', '.pyo')):
+        return {'pure': screen_module}
+    builds = {'compiled': screen_module}
+    source = os.path.join(os.path.dirname(path), 'screen.py')
+    if os.path.exists(source):
+        builds['pure'] = _load_source('neovim_gui._pure_screen', source)
+    return builds
+
+
+def _load_source(name, path):
+    if IS_PYTHON3:
+        from importlib.util import module_from_spec, spec_from_file_location
+        spec = spec_from_file_location(name, path)
+        module = module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    import imp
+    return imp.load_source(name, path)
+
+
+def run_benchmarks(builds, columns=200, rows=50, repeat=20, pattern=None,
+                   log=None):
+    """Run the workloads matching `pattern` with each screen build.
+
+    Returns a dict mapping `<workload>[<build>]` to the best and mean time
+    of one run, in seconds.
+    """
+    results = {}
+    for name, workload in WORKLOADS:
+        if pattern and pattern not in name:
+            continue
+        for build in sorted(builds):
+            key = '{0}[{1}]'.format(name, build)
+            try:
+                run = workload(builds[build].Screen, columns, rows)
+            except ImportError:
+                run = None
+            if not run:
+                if log:
+                    log('{0:<36} skipped'.format(key))
+                continue
+            times = []
+            for _ in range(repeat):
+                start = default_timer()
+                run()
+                times.append(default_timer() - start)
+            results[key] = {'best': min(times),
+                            'mean': sum(times) / len(times)}
+            if log:
+                log('{0:<36} {1:10.3f} ms {2:10.3f} ms'.format(
+                    key, min(times) * 1000, sum(times) / len(times) * 1000))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return the regressions of `results` against `baseline`.
+
+    A regression is a (name, ratio) pair for each benchmark whose best time
+    exceeds the baseline one by more than `threshold` times it.
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        ratio = results[name]['best'] / baseline[name]['best']
+        if ratio > 1 + threshold:
+            regressions.append((name, ratio,))
+    return regressions
+
+
+@click.command()
+@click.option('--columns', default=200, type=int)
+@click.option('--rows', default=50, type=int)
+@click.option('--repeat', default=20, type=int)
+@click.option('--filter', 'pattern')
+@click.option('--build', multiple=True, type=click.Choice(['pure',
+                                                           'compiled']))
+@click.option('--json', 'output')
+@click.option('--baseline')
+@click.option('--threshold', default=0.1, type=float)
+def main(columns, rows, repeat, pattern, build, output, baseline, threshold):
+    """Run the benchmarks."""
+    builds = screen_builds()
+    if build:
+        missing = set(build) - set(builds)
+        if missing:
+            raise click.UsageError('screen build not available: {0}'.format(
+                ', '.join(sorted(missing))))
+        builds = dict((b, builds[b]) for b in build)
+    click.echo('{0:<36} {1:>13} {2:>13}'.format('benchmark', 'best', 'mean'))
+    results = run_benchmarks(builds, columns, rows, repeat, pattern,
+                             click.echo)
+    if 'pure' in builds and 'compiled' in builds:
+        for name in sorted(results):
+            if name.endswith('[compiled]'):
+                pure = results[name[:-len('[compiled]')] + '[pure]']
+                click.echo('{0:<36} {1:10.2f}x faster'.format(
+                    name, pure['best'] / results[name]['best']))
+    if output:
+        data = {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'columns': columns,
+            'rows': rows,
+            'repeat': repeat,
+            'results': results,
+        }
+        with open(output, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f)['results'], threshold)
+        for name, ratio in regressions:
+            click.echo('regression: {0} is {1:.2f}x slower'.format(name,
+                                                                   ratio))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,10 @@
-"""CLI for accessing the gtk/tickit UIs implemented by this package."""
+"""CLI for accessing the gtk/terminal UIs implemented by this package."""
 import shlex
 
 import click
 
 from .ui_bridge import UIBridge
 from neovim import attach
-from neovim.api import DecodeHook
-from neovim.compat import IS_PYTHON3
 
 
 @click.command(context_settings=dict(allow_extra_args=True))
@@ -18,11 +16,65 @@ from neovim.compat import IS_PYTHON3
               default='disable',
               type=click.Choice(['ncalls', 'tottime', 'percall', 'cumtime',
                                  'name', 'disable']))
+@click.option('--profile-output')
+@click.option('--profile-collapsed', default=False, is_flag=True)
+@click.option('--profile-paused', default=False, is_flag=True)
+@click.option('--tty', default=False, is_flag=True)
+@click.option('--mirror')
+@click.option('--headless', default=False, is_flag=True)
+@click.option('--shared', default=False, is_flag=True)
+@click.option('--shm-framebuffer')
+@click.option('--max-fps', default=60, type=int)
+@click.option('--frame-stats', default=False, is_flag=True)
+@click.option('--single-loop', default=False, is_flag=True)
+@click.option('--trace-latency', default=False, is_flag=True)
+@click.option('--latency-bench', default=0, type=int)
+@click.option('--latency-output')
+@click.option('--record-redraw')
 @click.pass_context
-def main(ctx, prog, notify, listen, connect, profile):
+def main(ctx, prog, notify, listen, connect, profile, profile_output,
+         profile_collapsed, profile_paused, tty, mirror, headless, shared,
+         shm_framebuffer, max_fps, frame_stats, single_loop, trace_latency,
+         latency_bench, latency_output, record_redraw):
     """Entry point."""
+    if (tty or headless) and (single_loop or latency_bench):
+        raise click.UsageError('--single-loop and --latency-bench require '
+                               'the Gtk UI')
+    if headless and not mirror:
+        raise click.UsageError('--headless requires --mirror')
+    if profile_collapsed and not profile_output:
+        raise click.UsageError('--profile-collapsed requires --profile-output')
+    if profile_paused and profile == 'disable' and not profile_output:
+        raise click.UsageError('--profile-paused requires --profile or '
+                               '--profile-output')
+    if profile_paused and headless:
+        raise click.UsageError('--profile-paused can\'t be toggled with '
+                               '--headless')
     address = connect or listen
 
+    if shared:
+        if address or tty or mirror:
+            raise click.UsageError('--shared only supports embedded nvim '
+                                   'instances in the Gtk UI')
+        if (notify or profile != 'disable' or profile_output or
+                profile_collapsed or profile_paused or shm_framebuffer or
+                frame_stats or trace_latency or latency_bench or
+                latency_output or record_redraw):
+            raise click.UsageError('--shared doesn\'t support --notify, '
+                                   'profiling, tracing, --shm-framebuffer, '
+                                   '--frame-stats or --record-redraw')
+        import os
+        from .host_client import request_session
+        nvim_argv = shlex.split(prog or 'nvim --embed') + ctx.args
+        while not request_session(nvim_argv, os.getcwd()):
+            # only load Gtk once this process becomes the host
+            from .host import SessionHost
+            host = SessionHost(max_fps, single_loop)
+            if host.listen():
+                host.open_session(nvim_argv)
+                host.run()
+                return
+
     if address:
         import re
         p = re.compile(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}(?:\:\d{1,5})?$')
@@ -56,17 +108,47 @@ def main(ctx, prog, notify, listen, connect, profile):
                 # socket not ready yet
                 time.sleep(0.050)
     else:
-        # spawn embedded instance
-        nvim_argv = shlex.split(prog or 'nvim --embed') + ctx.args
+        # spawn embedded instance, benchmarks don't load the user config so
+        # their results can be compared
+        default_prog = ('nvim -u NONE -i NONE --embed' if latency_bench
+                        else 'nvim --embed')
+        nvim_argv = shlex.split(prog or default_prog) + ctx.args
         nvim = attach('child', argv=nvim_argv)
 
-    if IS_PYTHON3:
-        nvim = nvim.with_hook(DecodeHook())
+    profiler = None
+    if profile != 'disable' or profile_output:
+        from .profiler import Profiler
+        profiler = Profiler(profile if profile != 'disable' else None,
+                            profile_output, profile_collapsed, profile_paused)
+
+    tracer = None
+    if trace_latency or latency_bench:
+        from .latency import LatencyBenchmark, LatencyTracer
+        tracer = LatencyTracer()
 
-    from .gtk_ui import GtkUI
-    ui = GtkUI()
+    if headless:
+        ui = None
+    elif tty:
+        from .tty_ui import TtyUI
+        ui = TtyUI(max_fps=max_fps)
+    else:
+        from .gtk_ui import GtkUI
+        ui = GtkUI(max_fps=max_fps, cache_key=connect,
+                   shm_path=shm_framebuffer)
+    if mirror:
+        from .mirror import MirrorUI
+        ui = MirrorUI(mirror, ui)
     bridge = UIBridge()
-    bridge.connect(nvim, ui, profile if profile != 'disable' else None, notify)
+    if latency_bench:
+        print('bridge: {0}'.format('single-loop' if single_loop
+                                   else 'threaded'))
+        LatencyBenchmark(tracer, latency_bench, latency_output).start(bridge)
+    bridge.connect(nvim, ui, profiler, notify, single_loop, tracer,
+                   record_redraw)
+    if frame_stats and ui.frame_stats:
+        print(ui.frame_stats)
+    if trace_latency and not latency_bench:
+        print(tracer)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,144 @@
+"""Drive a nvim msgpack-rpc session from the GLib main loop.
+
+The session normally runs its event loop on a separate thread, and every
+notification or input crosses threads. In single-loop mode the session's
+asyncio loop runs in a greenlet on the GLib thread instead. Whenever the
+asyncio loop would block in `select`, it switches back to the GLib main loop,
+which resumes it once the selector fd becomes readable or the next asyncio
+timer is due.
+
+The input latency of both bridge modes can be compared by typing the same
+scripted keys with each, which prints p50/p95/p99 latencies per stage:
+
+    pynvim --latency-bench 2000 --latency-output threaded.json
+    pynvim --single-loop --latency-bench 2000 --latency-output single.json
+"""
+import logging
+import math
+from traceback import format_exc
+
+import greenlet
+
+from gi.repository import GLib
+
+try:
+    from asyncio import events
+except ImportError:
+    events = None
+
+
+__all__ = ('GLibSessionDriver',)
+
+
+logger = logging.getLogger(__name__)
+
+
+class GLibSelector(object):
+
+    """Selector wrapper that yields to GLib instead of blocking."""
+
+    def __init__(self, selector, loop_greenlet):
+        """Wrap `selector`, used by the loop running in `loop_greenlet`."""
+        self._selector = selector
+        self._loop_greenlet = loop_greenlet
+        self._watch_id = None
+        self._timer_id = None
+
+    def __getattr__(self, name):
+        """Delegate everything but `select` to the wrapped selector."""
+        return getattr(self._selector, name)
+
+    def select(self, timeout=None):
+        """Poll the wrapped selector, yielding to GLib until it is ready."""
+        ready = self._selector.select(0)
+        if ready or timeout == 0:
+            return ready
+        self._watch_id = GLib.io_add_watch(self._selector.fileno(),
+                                           GLib.PRIORITY_DEFAULT,
+                                           GLib.IO_IN, self._on_ready)
+        if timeout is not None:
+            self._timer_id = GLib.timeout_add(int(math.ceil(timeout * 1000)),
+                                              self._on_timeout)
+        # Since python 3.7 asyncio refuses to run a loop while another one is
+        # marked as running in the thread, which would be the case for other
+        # sessions driven by the same GLib loop.
+        running = _get_running_loop()
+        _set_running_loop(None)
+        self._loop_greenlet.parent.switch()
+        _set_running_loop(running)
+        # The loop may also be resumed by a request sent from the GLib side,
+        # in which case both sources are still registered.
+        for source_id in (self._watch_id, self._timer_id):
+            if source_id is not None:
+                GLib.source_remove(source_id)
+        self._watch_id = self._timer_id = None
+        return self._selector.select(0)
+
+    def _on_ready(self, *args):
+        self._watch_id = None
+        self._loop_greenlet.switch()
+        return False
+
+    def _on_timeout(self):
+        self._timer_id = None
+        self._loop_greenlet.switch()
+        return False
+
+
+def _get_running_loop():
+    if events and hasattr(events, '_get_running_loop'):
+        return events._get_running_loop()
+    return None
+
+
+def _set_running_loop(loop):
+    if events and hasattr(events, '_set_running_loop'):
+        events._set_running_loop(loop)
+
+
+class GLibSessionDriver(object):
+
+    """Run a nvim session on the GLib main loop of the calling thread."""
+
+    def __init__(self, nvim):
+        """Initialize the driver for the session of `nvim`."""
+        session = getattr(nvim, '_session', nvim.session)
+        event_loop = session._async_session._msgpack_stream._event_loop
+        loop = getattr(event_loop, '_loop', None)
+        selector = getattr(loop, '_selector', None)
+        if not hasattr(selector, 'fileno'):
+            raise Exception('Single loop mode requires the asyncio event '
+                            'loop backend with a pollable selector')
+        self._loop = loop
+        self._selector = selector
+        self._greenlet = None
+
+    def start(self, run):
+        """Call `run` on a greenlet that yields whenever it would block.
+
+        `run` is expected to run the session event loop. This returns as
+        soon as the loop waits for nvim for the first time.
+        """
+        self._greenlet = greenlet.greenlet(run)
+        # Poking at the private selector is the only way of hooking into
+        # asyncio loops created by the nvim client.
+        self._loop._selector = GLibSelector(self._selector, self._greenlet)
+        self._greenlet.switch()
+
+    def call(self, fn, *args):
+        """Call `fn` on a greenlet of the running session.
+
+        Requests sent by `fn` yield to the event loop, which returns to the
+        caller as soon as it waits for nvim again.
+        """
+        if not self._greenlet or self._greenlet.dead:
+            return
+
+        def handler():
+            try:
+                fn(*args)
+            except Exception:
+                logger.warning('error caught while executing call\n%s\n',
+                               format_exc())
+
+        greenlet.greenlet(handler, parent=self._greenlet).switch()
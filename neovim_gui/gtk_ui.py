@@ -1,11 +1,17 @@
 """Neovim Gtk+ UI."""
+import json
 import math
+import os
+import re
+import signal
+import struct
 
 import cairo
 
 from gi.repository import GLib, GObject, Gdk, Gtk, Pango, PangoCairo
 
-from .screen import Screen
+from .screen import Screen, diff_snapshots
+from .stats import FrameStats
 
 
 __all__ = ('GtkUI',)
@@ -58,12 +64,33 @@ if (GLib.MAJOR_VERSION, GLib.MINOR_VERSION,) <= (2, 32,):
     GLib.threads_init()
 
 
+# Render caches shared by all GtkUI instances of the process: font metrics by
+# font string, escaped pango text by text and pango attributes by the default
+# colors and bold letter spacing they were computed with.
+SCREEN_CACHE_VERSION = 1
+FONT_METRICS_CACHE = {}
+PANGO_TEXT_CACHE = {}
+PANGO_ATTRS_CACHES = {}
+
+
 class GtkUI(object):
 
     """Gtk+ UI class."""
 
-    def __init__(self):
-        """Initialize the UI instance."""
+    def __init__(self, max_fps=60, cache_key=None, shm_path=None):
+        """Initialize the UI instance.
+
+        Redraw batches received from nvim are coalesced and painted at most
+        `max_fps` times per second. A `max_fps` of 0 paints every batch as
+        soon as possible.
+
+        If `cache_key` is given, the screen and font metrics are saved under
+        that key on exit and the cached screen is painted on the next start,
+        until nvim has redrawn it.
+
+        With `shm_path`, the backing surface is a `SharedFramebuffer` mapped
+        from that file, which other processes can read frames from.
+        """
         self._redraw_arg = None
         self._foreground = -1
         self._background = -1
@@ -80,11 +107,49 @@ class GtkUI(object):
         self._pressed = None
         self._invalid = None
         self._pending = [0, 0, 0]
+        self._frame_interval = 1.0 / max_fps if max_fps > 0 else 0
+        self._frame_timer_id = None
+        self._frame_deadline = 0
+        self._last_frame = 0
+        self._pending_updates = []
+        self.frame_stats = FrameStats(self._frame_interval)
+        self._cache_key = cache_key
+        self._font_metrics = None
+        self._bold_spacing = None
+        self._on_close = None
+        self._restored = None
+        self._reconciling = False
+        self._shm = None
+        self._cairo_surface = None
+        if shm_path:
+            from .shm_framebuffer import SharedFramebuffer
+            self._shm = SharedFramebuffer(shm_path)
         self._reset_cache()
 
     def start(self, bridge):
         """Start the UI event loop."""
-        bridge.attach(80, 24, True)
+        self.open(bridge)
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1,
+                             self._gtk_toggle_profile)
+        Gtk.main()
+        self._save_screen_cache()
+        self._close_framebuffer()
+
+    def open(self, bridge, on_close=None):
+        """Open the UI window without running the UI event loop.
+
+        This is used to host multiple UIs in a single Gtk main loop. When
+        `on_close` is given, `quit` closes the window and calls it instead
+        of exiting the main loop.
+        """
+        self._on_close = on_close
+        cached = _load_screen_cache(self._cache_key)
+        if cached:
+            metrics, screen, snapshot = cached
+            self._font_metrics = metrics
+            bridge.attach(screen.columns, screen.rows, True)
+        else:
+            bridge.attach(80, 24, True)
         drawing_area = Gtk.DrawingArea()
         drawing_area.connect('draw', self._gtk_draw)
         window = Gtk.Window()
@@ -109,41 +174,162 @@ class GtkUI(object):
         self._window = window
         self._im_context = im_context
         self._bridge = bridge
-        Gtk.main()
+        if cached:
+            self._restore_screen(screen, metrics, snapshot)
 
     def quit(self):
         """Exit the UI event loop."""
-        GObject.idle_add(Gtk.main_quit)
+        if self._on_close:
+            GObject.idle_add(self._close)
+        else:
+            GObject.idle_add(Gtk.main_quit)
+
+    def _close(self):
+        for timer_id in (self._blink_timer_id, self._frame_timer_id,
+                         self._resize_timer_id):
+            if timer_id is not None:
+                GLib.source_remove(timer_id)
+        self._blink_timer_id = self._frame_timer_id = None
+        self._resize_timer_id = None
+        self._window.destroy()
+        self._save_screen_cache()
+        self._close_framebuffer()
+        self._on_close(self)
+        return False
+
+    def _close_framebuffer(self):
+        if not self._shm:
+            return
+        if self._cairo_surface:
+            # release the mapped pixels before unmapping them
+            self._cairo_surface.finish()
+        self._shm.close()
+
+    def _save_screen_cache(self):
+        if self._cache_key and self._screen:
+            metrics = dict(self._font_metrics, foreground=self._foreground,
+                           background=self._background,
+                           version=SCREEN_CACHE_VERSION)
+            _save_screen_cache(self._cache_key, metrics,
+                               self._screen.snapshot())
 
     def schedule_screen_update(self, apply_updates):
         """Schedule screen updates to run in the UI event loop."""
-        def wrapper():
+        GObject.idle_add(self._queue_screen_update, apply_updates)
+
+    def _queue_screen_update(self, apply_updates):
+        self._pending_updates.append(apply_updates)
+        if self._frame_timer_id is None:
+            # paint immediately if the last frame is older than the frame
+            # interval, else wait until the next frame is due
+            now = _monotonic_time()
+            deadline = max(now, self._last_frame + self._frame_interval)
+            self._frame_deadline = deadline
+            self._frame_timer_id = GLib.timeout_add(
+                int((deadline - now) * 1000), self._frame)
+        return False
+
+    def _frame(self):
+        self._frame_timer_id = None
+        start = _monotonic_time()
+        updates = self._pending_updates
+        self._pending_updates = []
+        if self._shm:
+            self._shm.begin_frame()
+        for apply_updates in updates:
             apply_updates()
-            self._flush()
-            self._start_blinking()
-            self._screen_invalid()
-        GObject.idle_add(wrapper)
+        if self._reconciling:
+            self._reconcile()
+        self._flush()
+        if self._shm:
+            self._cairo_surface.flush()
+            self._shm.end_frame()
+        self._start_blinking()
+        self._screen_invalid()
+        self._last_frame = start
+        self.frame_stats.record(len(updates), start - self._frame_deadline,
+                                _monotonic_time() - start)
+        return False
 
     def _screen_invalid(self):
         self._drawing_area.queue_draw()
 
+    def _restore_screen(self, screen, metrics, snapshot):
+        # paint the cached screen while nvim redraws
+        self._foreground = metrics['foreground']
+        self._background = metrics['background']
+        if self._shm:
+            # the surface is blank until the cached screen is painted
+            self._shm.begin_frame()
+        self._init_surface(screen.columns, screen.rows)
+        self._screen = screen
+        self._clear_region(0, screen.rows, 0, screen.columns)
+        for row in range(screen.rows):
+            self._pending = [row, 0, screen.columns]
+            self._flush()
+        if self._shm:
+            self._cairo_surface.flush()
+            self._shm.end_frame()
+        self._restored = snapshot
+        self._screen_invalid()
+
+    def _reconcile(self):
+        # nvim redrew the screen over the restored one without painting,
+        # only repaint the rows that differ from the restored screen
+        self._reconciling = False
+        screen = self._screen
+        changed = diff_snapshots(self._restored, screen.snapshot())
+        self._restored = None
+        for row, _ in changed:
+            self._clear_region(row, row + 1, 0, screen.columns)
+            self._pending = [row, 0, screen.columns]
+            self._flush()
+
     def _nvim_resize(self, columns, rows):
+        if self._restored:
+            screen = self._screen
+            if (screen.columns, screen.rows) == (columns, rows):
+                # keep the restored surface until nvim finished redrawing
+                self._screen = Screen(columns, rows)
+                self._reconciling = True
+                return
+            self._restored = None
+        self._init_surface(columns, rows)
+        self._screen = Screen(columns, rows)
+
+    def _init_surface(self, columns, rows):
         da = self._drawing_area
         # create FontDescription object for the selected font/size
         font_str = '{0} {1}'.format(self._font_name, self._font_size)
-        self._font, pixels, normal_width, bold_width = _parse_font(font_str)
-        # calculate the letter_spacing required to make bold have the same
-        # width as normal
-        self._bold_spacing = normal_width - bold_width
+        metrics = self._font_metrics
+        if not metrics or metrics['font'] != font_str:
+            metrics = FONT_METRICS_CACHE.get(font_str, None)
+        if metrics:
+            self._font = Pango.font_description_from_string(font_str)
+        else:
+            self._font, pixels, normal_width, bold_width = \
+                _parse_font(font_str)
+            # calculate the letter_spacing required to make bold have the
+            # same width as normal
+            metrics = {'font': font_str, 'pixels': list(pixels),
+                       'bold_spacing': normal_width - bold_width}
+        FONT_METRICS_CACHE[font_str] = self._font_metrics = metrics
+        pixels = metrics['pixels']
+        if self._bold_spacing != metrics['bold_spacing']:
+            self._bold_spacing = metrics['bold_spacing']
+            self._reset_cache()
         cell_pixel_width, cell_pixel_height = pixels
         # calculate the total pixel width/height of the drawing area
         pixel_width = cell_pixel_width * columns
         pixel_height = cell_pixel_height * rows
-        gdkwin = da.get_window()
-        content = cairo.CONTENT_COLOR
-        self._cairo_surface = gdkwin.create_similar_surface(content,
-                                                            pixel_width,
-                                                            pixel_height)
+        if self._shm:
+            self._cairo_surface = self._shm.resize(pixel_width, pixel_height)
+        else:
+            gdkwin = da.get_window()
+            content = cairo.CONTENT_COLOR
+            self._cairo_surface = gdkwin.create_similar_surface(content,
+                                                                pixel_width,
+                                                                pixel_height)
         self._cairo_context = cairo.Context(self._cairo_surface)
         self._pango_layout = PangoCairo.create_layout(self._cairo_context)
         self._pango_layout.set_alignment(Pango.Alignment.LEFT)
@@ -151,7 +337,6 @@ class GtkUI(object):
         self._pixel_width, self._pixel_height = pixel_width, pixel_height
         self._cell_pixel_width = cell_pixel_width
         self._cell_pixel_height = cell_pixel_height
-        self._screen = Screen(columns, rows)
         self._window.resize(pixel_width, pixel_height)
 
     def _nvim_clear(self):
@@ -186,6 +371,9 @@ class GtkUI(object):
         self._screen.set_scroll_region(top, bot, left, right)
 
     def _nvim_scroll(self, count):
+        if self._reconciling:
+            self._screen.scroll(count)
+            return
         self._flush()
         top, bot = self._screen.top, self._screen.bot + 1
         left, right = self._screen.left, self._screen.right + 1
@@ -234,6 +422,7 @@ class GtkUI(object):
         # Do the move
         self._cairo_context.paint()
         self._cairo_context.restore()
+        self._damage(dst_top, dst_bot, left, right)
         # Clear the emptied region
         self._clear_region(clr_top, clr_bot, left, right)
         self._screen.scroll(count)
@@ -296,6 +485,8 @@ class GtkUI(object):
             row, col = self._screen.row, self._screen.col
             text, attrs = self._screen.get_cursor()
             self._pango_draw(row, col, [(text, attrs,)], cr=cr, cursor=True)
+        if self._bridge.tracer:
+            self._bridge.tracer.painted()
 
     def _gtk_configure(self, widget, event):
         def resize(*args):
@@ -320,6 +511,8 @@ class GtkUI(object):
         self._bridge.exit()
 
     def _gtk_key(self, widget, event, *args):
+        if self._bridge.tracer:
+            self._bridge.tracer.key_event()
         # This function was adapted from pangoterm source code
         keyval = event.keyval
         state = event.state
@@ -330,10 +523,16 @@ class GtkUI(object):
                 self._im_context.filter_keypress(event))
         if done:
             # input method handled keypress
+            self._key_ignored()
             return True
         if event.is_modifier:
             # We don't need to track the state of modifier bits
+            self._key_ignored()
             return
+        if (keyval == Gdk.KEY_F12 and state & CTRL and state & SHIFT and
+                self._bridge.toggle_profile()):
+            self._key_ignored()
+            return True
         # translate keyval to nvim key
         key_name = Gdk.keyval_name(keyval)
         if key_name.startswith('KP_'):
@@ -341,6 +540,10 @@ class GtkUI(object):
         input_str = _stringify_key(KEY_TABLE.get(key_name, key_name), state)
         self._bridge.input(input_str)
 
+    def _key_ignored(self):
+        if self._bridge.tracer:
+            self._bridge.tracer.key_ignored()
+
     def _gtk_button_press(self, widget, event, *args):
         if not self._mouse_enabled or event.type != Gdk.EventType.BUTTON_PRESS:
             return
@@ -383,7 +586,14 @@ class GtkUI(object):
         input_str += '<{0},{1}>'.format(col, row)
         self._bridge.input(input_str)
 
+    def _gtk_toggle_profile(self, *args):
+        self._bridge.toggle_profile()
+        return True
+
     def _gtk_input(self, widget, input_str, *args):
+        if self._bridge.tracer:
+            # commits from filter_keypress belong to the key being handled
+            self._bridge.tracer.input_event()
         self._bridge.input(input_str.replace('<', '<lt>'))
 
     def _start_blinking(self):
@@ -397,6 +607,8 @@ class GtkUI(object):
         blink()
 
     def _clear_region(self, top, bot, left, right):
+        if self._reconciling:
+            return
         self._flush()
         self._cairo_context.save()
         self._mask_region(top, bot, left, right)
@@ -405,6 +617,12 @@ class GtkUI(object):
         self._cairo_context.set_source_rgb(r, g, b)
         self._cairo_context.paint()
         self._cairo_context.restore()
+        self._damage(top, bot, left, right)
+
+    def _damage(self, top, bot, left, right):
+        if self._shm:
+            x1, y1, x2, y2 = self._get_rect(top, bot, left, right)
+            self._shm.damage(x1, y1, x2 - x1, y2 - y1)
 
     def _mask_region(self, top, bot, left, right, cr=None):
         if not cr:
@@ -428,7 +646,7 @@ class GtkUI(object):
         self._pending[0] = self._screen.row
         self._pending[1] = self._screen.col
         self._pending[2] = self._screen.col
-        if startcol == endcol:
+        if startcol == endcol or self._reconciling:
             return
         self._cairo_context.save()
         ccol = startcol
@@ -448,6 +666,7 @@ class GtkUI(object):
         if buf:
             self._pango_draw(row, ccol, buf)
         self._cairo_context.restore()
+        self._damage(row, row + 1, startcol, endcol)
 
     def _pango_draw(self, row, col, data, cr=None, cursor=False):
         markup = []
@@ -519,8 +738,9 @@ class GtkUI(object):
         return rv
 
     def _reset_cache(self):
-        self._pango_text_cache = {}
-        self._pango_attrs_cache = {}
+        self._pango_text_cache = PANGO_TEXT_CACHE
+        key = (self._foreground, self._background, self._bold_spacing,)
+        self._pango_attrs_cache = PANGO_ATTRS_CACHES.setdefault(key, {})
 
     def _redraw_glitch_fix(self):
         row, col = self._screen.row, self._screen.col
@@ -547,6 +767,11 @@ class GtkUI(object):
         self._pending[2] = max(rcol, self._pending[2])
 
 
+def _monotonic_time():
+    # frame pacing must not follow steps of the wall clock
+    return GLib.get_monotonic_time() / 1000000.0
+
+
 def _split_color(n):
     return ((n >> 16) & 0xff, (n >> 8) & 0xff, n & 0xff,)
 
@@ -571,6 +796,60 @@ def _stringify_key(key, state):
     return '<' + '-'.join(send) + '>'
 
 
+def _screen_cache_path(key):
+    cache_dir = os.environ.get('XDG_CACHE_HOME',
+                               os.path.expanduser('~/.cache'))
+    name = re.sub(r'[^\w.-]', '_', key) + '.screen'
+    return os.path.join(cache_dir, 'neovim-gui', name)
+
+
+def _load_screen_cache(key):
+    # Any cache that can't be used as is, like a truncated file or one written
+    # by another version, is a cache miss.
+    if not key:
+        return None
+    try:
+        with open(_screen_cache_path(key), 'rb') as f:
+            metrics, snapshot = f.read().split(b'\n', 1)
+        metrics = json.loads(metrics.decode('utf-8'))
+        if metrics.get('version') != SCREEN_CACHE_VERSION:
+            return None
+        width, height = [int(n) for n in metrics['pixels']]
+        metrics = {
+            'font': str(metrics['font']),
+            'pixels': [width, height],
+            'bold_spacing': int(metrics['bold_spacing']),
+            'foreground': int(metrics['foreground']),
+            'background': int(metrics['background']),
+        }
+        screen = Screen.from_snapshot(snapshot)
+        if not screen.columns or not screen.rows:
+            return None
+        return metrics, screen, snapshot
+    except (IOError, OSError, ValueError, KeyError, IndexError, TypeError,
+            AttributeError, struct.error):
+        return None
+
+
+def _save_screen_cache(key, metrics, snapshot):
+    # The snapshot holds the text of the screen, keep it private to the user
+    # and replace the file atomically, so a crash can't leave it truncated.
+    path = _screen_cache_path(key)
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), 0o700)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(json.dumps(metrics).encode('utf-8') + b'\n' + snapshot)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
 def _parse_font(font, cr=None):
     if not cr:
         ims = cairo.ImageSurface(cairo.FORMAT_RGB24, 300, 300)
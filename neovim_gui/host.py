@@ -0,0 +1,178 @@
+"""Host multiple nvim sessions in a single GUI process.
+
+The first `pynvim --shared` process becomes the host: it listens on a UNIX
+domain socket and runs every session in its own Gtk window, on a single Gtk
+main loop. Font metrics and pango caches are shared by all windows. Later
+invocations send their nvim command line to the host and exit, so opening a
+new editor doesn't start a new interpreter.
+
+Sessions are started in the working directory of the requesting process,
+but with the environment of the host.
+"""
+import errno
+import fcntl
+import json
+import os
+import socket
+from threading import Thread
+
+from gi.repository import GLib, Gtk
+
+from neovim import attach
+
+from .gtk_ui import GtkUI
+from .host_client import host_address, is_listening
+from .ui_bridge import UIBridge
+
+
+__all__ = ('SessionHost',)
+
+
+class SessionHost(object):
+
+    """Run nvim sessions requested through the host socket."""
+
+    def __init__(self, max_fps=60, single_loop=False, path=None):
+        """Initialize the SessionHost instance."""
+        self._max_fps = max_fps
+        self._single_loop = single_loop
+        self._path = path or host_address()
+        self._sessions = []
+        self._starting = 0
+
+    def open_session(self, argv, cwd=None, callback=None):
+        """Spawn an embedded nvim with `argv` and open a window for it.
+
+        nvim is started on a separate thread, so the windows of other
+        sessions stay responsive meanwhile. `callback` is called from the
+        Gtk main loop with None once the window opened, or with the error
+        that prevented it.
+        """
+        if cwd:
+            argv = ['sh', '-c', 'cd -- "$1" && shift && exec "$@"', 'sh',
+                    cwd] + list(argv)
+        self._starting += 1
+        t = Thread(target=self._spawn, args=(argv, callback,))
+        t.daemon = True
+        t.start()
+
+    def listen(self):
+        """Start listening on the host socket.
+
+        Returns False if another host is already listening on it. The check
+        and the bind are done while holding a lock file, so only one of the
+        processes started at the same time becomes the host.
+        """
+        fd = os.open(self._path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if is_listening(self._path):
+                return False
+            if os.path.exists(self._path):
+                # left behind by a host that didn't exit cleanly
+                os.unlink(self._path)
+            self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            umask = os.umask(0o177)
+            try:
+                self._server.bind(self._path)
+            finally:
+                os.umask(umask)
+            self._server.listen(16)
+            return True
+        finally:
+            os.close(fd)
+
+    def run(self):
+        """Serve session requests until the last session exits.
+
+        `listen` must have succeeded before.
+        """
+        GLib.io_add_watch(self._server.fileno(), GLib.PRIORITY_DEFAULT,
+                          GLib.IO_IN, self._accept)
+        try:
+            Gtk.main()
+        finally:
+            self._server.close()
+            os.unlink(self._path)
+
+    def _spawn(self, argv, callback):
+        try:
+            nvim = attach('child', argv=argv)
+        except Exception as e:
+            GLib.idle_add(self._session_opened, None, e, callback)
+            return
+        GLib.idle_add(self._session_opened, nvim, None, callback)
+
+    def _session_opened(self, nvim, error, callback):
+        self._starting -= 1
+        if nvim:
+            try:
+                bridge = UIBridge()
+                bridge.open(nvim, GtkUI(max_fps=self._max_fps),
+                            self._single_loop, on_close=self._session_closed)
+                self._sessions.append(bridge)
+            except Exception as e:
+                error = e
+        if callback:
+            callback(error)
+        elif error:
+            print(error)
+        self._quit_if_idle()
+        return False
+
+    def _accept(self, *args):
+        sock, _ = self._server.accept()
+        sock.setblocking(False)
+        Request(self, sock)
+        return True
+
+    def _session_closed(self, bridge):
+        self._sessions.remove(bridge)
+        self._quit_if_idle()
+
+    def _quit_if_idle(self):
+        if not self._sessions and not self._starting:
+            Gtk.main_quit()
+
+
+class Request(object):
+
+    """Session request read from a client without blocking the main loop."""
+
+    def __init__(self, host, sock):
+        """Start reading the request sent through `sock`."""
+        self._host = host
+        self._sock = sock
+        self._buf = b''
+        GLib.io_add_watch(sock.fileno(), GLib.PRIORITY_DEFAULT,
+                          GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR,
+                          self._read)
+
+    def _read(self, *args):
+        try:
+            data = self._sock.recv(4096)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return True
+            data = b''
+        self._buf += data
+        if data and b'\n' not in self._buf:
+            return True
+        try:
+            request = json.loads(self._buf.split(b'\n', 1)[0].decode('utf-8'))
+            argv = request['argv']
+        except (ValueError, KeyError, TypeError):
+            self._sock.close()
+            return False
+        self._host.open_session(argv, request.get('cwd'), self._reply)
+        return False
+
+    def _reply(self, error):
+        reply = str(error).encode('utf-8') if error else b'ok'
+        try:
+            # the reply fits in the empty socket buffer
+            self._sock.sendall(reply + b'\n')
+        except socket.error:
+            pass
+        finally:
+            self._sock.close()
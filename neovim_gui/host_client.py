@@ -0,0 +1,61 @@
+"""Client side of the session host.
+
+This is kept apart from `host` so requesting a session from a running host
+doesn't load Gtk.
+"""
+import json
+import os
+import socket
+import tempfile
+
+
+__all__ = ('host_address', 'request_session')
+
+
+def host_address():
+    """Return the path of the host socket for the current user."""
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(runtime_dir,
+                        'neovim-gui-{0}.sock'.format(os.getuid()))
+
+
+def request_session(argv, cwd, path=None):
+    """Ask a running host to open a session for `argv` in `cwd`.
+
+    Returns False if no host is listening on `path`.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path or host_address())
+        sock.sendall(json.dumps({'argv': argv, 'cwd': cwd}).encode('utf-8') +
+                     b'\n')
+        reply = _read_line(sock)
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+    if reply != b'ok':
+        raise Exception(reply.decode('utf-8', 'replace'))
+    return True
+
+
+def is_listening(path):
+    """Return True if something accepts connections on the socket `path`."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+
+def _read_line(sock):
+    buf = b''
+    while not buf.endswith(b'\n'):
+        data = sock.recv(4096)
+        if not data:
+            break
+        buf += data
+    return buf.rstrip(b'\n')
@@ -0,0 +1,223 @@
+"""Input-to-photon latency tracing."""
+import json
+from threading import Lock
+
+try:
+    from time import monotonic
+except ImportError:
+    # python 2
+    from time import time as monotonic
+
+
+__all__ = ('LatencyTracer', 'LatencyBenchmark')
+
+
+STAGES = ('gtk', 'rpc', 'apply', 'paint', 'total')
+
+
+class LatencySample(object):
+    def __init__(self, event_time, queued_time):
+        self.event_time = event_time
+        self.queued_time = queued_time
+        self.received_time = None
+        self.batch = None
+        self.applied_time = None
+
+    def stages(self, painted_time):
+        return {
+            'gtk': self.queued_time - self.event_time,
+            'rpc': self.received_time - self.queued_time,
+            'apply': self.applied_time - self.received_time,
+            'paint': painted_time - self.applied_time,
+            'total': painted_time - self.event_time,
+        }
+
+
+class LatencyTracer(object):
+
+    """Trace keystrokes until the frame that presents them is painted.
+
+    Each keystroke is timestamped when the UI starts handling the key event
+    and when its input is queued for nvim. It is then correlated with the
+    first redraw batch received after it was queued, with the application of
+    that batch and with the next paint of the window.
+    """
+
+    def __init__(self):
+        """Initialize the LatencyTracer instance."""
+        self._lock = Lock()
+        self._event_time = None
+        self._batch = 0
+        self._waiting = []
+        self._received = []
+        self._applied = []
+        self.samples = []
+        self.paints = 0
+
+    def key_event(self):
+        """Mark the start of a key event handled by the UI."""
+        self._event_time = monotonic()
+
+    def input_event(self):
+        """Mark the start of an input event, like an input method commit.
+
+        Unlike `key_event`, this keeps the time of a key event whose handling
+        produced the input.
+        """
+        if self._event_time is None:
+            self._event_time = monotonic()
+
+    def key_ignored(self):
+        """Mark that the last key event didn't produce any input."""
+        self._event_time = None
+
+    def input_queued(self):
+        """Mark that the input of the last key event was queued for nvim.
+
+        Inputs that don't come from a key event, like mouse events, are not
+        traced.
+        """
+        event_time = self._event_time
+        if event_time is None:
+            return
+        now = monotonic()
+        self._event_time = None
+        with self._lock:
+            self._waiting.append(LatencySample(event_time, now))
+
+    def redraw_received(self):
+        """Mark the reception of a redraw batch, returning its id."""
+        now = monotonic()
+        with self._lock:
+            self._batch += 1
+            for sample in self._waiting:
+                sample.received_time = now
+                sample.batch = self._batch
+            self._received.extend(self._waiting)
+            self._waiting = []
+            return self._batch
+
+    def redraw_applied(self, batch):
+        """Mark that the redraw batch `batch` was applied to the screen."""
+        now = monotonic()
+        with self._lock:
+            received = []
+            for sample in self._received:
+                if sample.batch <= batch:
+                    sample.applied_time = now
+                    self._applied.append(sample)
+                else:
+                    received.append(sample)
+            self._received = received
+
+    def painted(self):
+        """Mark that the window was painted."""
+        now = monotonic()
+        with self._lock:
+            self.paints += 1
+            for sample in self._applied:
+                self.samples.append(sample.stages(now))
+            self._applied = []
+
+    def pending(self):
+        """Return the number of inputs that were not painted yet."""
+        with self._lock:
+            return (len(self._waiting) + len(self._received) +
+                    len(self._applied))
+
+    def discard_pending(self):
+        """Forget inputs that were not painted yet."""
+        with self._lock:
+            self._waiting = []
+            self._received = []
+            self._applied = []
+
+    def summary(self):
+        """Return p50/p95/p99 latencies in milliseconds for each stage."""
+        rv = {'samples': len(self.samples)}
+        for stage in STAGES:
+            values = sorted(s[stage] * 1000 for s in self.samples)
+            rv[stage] = dict(('p{0}'.format(p), _percentile(values, p))
+                             for p in (50, 95, 99))
+        return rv
+
+    def __str__(self):
+        """Format the summary as a table."""
+        summary = self.summary()
+        lines = ['keystroke latency ({0} samples)'.format(summary['samples']),
+                 '{0:<8}{1:>10}{2:>10}{3:>10}'.format('stage', 'p50', 'p95',
+                                                      'p99')]
+        for stage in STAGES:
+            s = summary[stage]
+            lines.append('{0:<8}{1:>8.2f}ms{2:>8.2f}ms{3:>8.2f}ms'.format(
+                stage, s['p50'], s['p95'], s['p99']))
+        return '\n'.join(lines)
+
+
+class LatencyBenchmark(object):
+
+    """Type scripted keys into nvim and trace their latency.
+
+    Keys are sent one at a time through the bridge once the previous key was
+    painted(or timed out), starting after the first paint of the UI. When all
+    keys were traced, the report is printed and nvim is closed.
+    """
+
+    def __init__(self, tracer, count, output=None, timeout=1.0):
+        """Initialize the LatencyBenchmark instance."""
+        self._tracer = tracer
+        self._count = count
+        self._output = output
+        self._timeout = timeout
+        self._sent = 0
+        self._sent_time = 0
+        self.timeouts = 0
+
+    def start(self, bridge):
+        """Start typing keys when the UI is ready."""
+        from gi.repository import GLib
+        self._bridge = bridge
+        GLib.timeout_add(10, self._tick)
+
+    def _tick(self):
+        if not self._tracer.paints:
+            # wait for the UI to show up
+            return True
+        if self._tracer.pending():
+            if monotonic() - self._sent_time < self._timeout:
+                return True
+            self.timeouts += 1
+            self._tracer.discard_pending()
+        if self._sent == self._count:
+            self._finish()
+            return False
+        if self._sent == 0:
+            key = 'i'
+        elif self._sent % 60 == 0:
+            key = '<CR>'
+        else:
+            key = chr(ord('a') + self._sent % 26)
+        self._sent += 1
+        self._sent_time = monotonic()
+        self._tracer.key_event()
+        self._bridge.input(key)
+        return True
+
+    def _finish(self):
+        print(self._tracer)
+        if self.timeouts:
+            print('timeouts: {0}'.format(self.timeouts))
+        if self._output:
+            summary = self._tracer.summary()
+            summary['timeouts'] = self.timeouts
+            with open(self._output, 'w') as f:
+                json.dump(summary, f, indent=2, sort_keys=True)
+        self._bridge.exit()
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1,
+                       int(round(p / 100.0 * len(values))) - 1))
+    return values[index]
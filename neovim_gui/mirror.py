@@ -0,0 +1,413 @@
+"""Read-only mirroring of a nvim session to many viewers.
+
+`MirrorUI` sits between `UIBridge` and the real UI(or runs headless) and
+keeps an authoritative `Screen`, fed by the same redraw stream. Viewers
+connect to a UNIX domain socket and receive newline-delimited JSON messages:
+
+- `snapshot`: the full screen, sent after connecting, resizing or when all
+  rows changed.
+- `damage`: the rows that changed since the last message, plus the cursor.
+
+Rows are encoded as runs of `[col, highlight_id, text]`, where `text` is a
+string when every cell holds a single character or else a list with the text
+of each cell. Highlights are sent once as `{id: attrs}` maps before they are
+used. Viewers that can't keep up don't stall the source: their damaged rows
+accumulate while their socket is busy and are sent in a single message once
+it drains.
+"""
+import errno
+import json
+import os
+import select
+import socket
+import stat
+import sys
+from threading import Event, Lock, Thread
+
+from .host_client import is_listening
+from .screen import Screen
+
+
+__all__ = ('MirrorUI', 'MirrorViewer')
+
+
+class Viewer(object):
+    def __init__(self, sock):
+        self.sock = sock
+        self.buf = b''
+        self.dirty = set()
+        self.cursor = False
+        self.snapshot = True
+        self.highlights = 0
+
+
+class MirrorUI(object):
+
+    """UI that mirrors the screen to viewers connected to `path`."""
+
+    def __init__(self, path, ui=None, columns=80, rows=24):
+        """Initialize the MirrorUI instance.
+
+        Redraw events are forwarded to `ui` when given. Without it, the
+        mirror runs headless and attaches to nvim with `columns`x`rows`.
+        """
+        self._path = path
+        self._ui = ui
+        self._size = (columns, rows,)
+        self._screen = None
+        self._attrs = 0
+        self._highlights = [None]
+        self._highlight_ids = {None: 0}
+        self._foreground = -1
+        self._background = -1
+        self._dirty = set()
+        self._cursor_moved = False
+        self._lock = Lock()
+        self._viewers = []
+        self._quit = False
+        self._queue = []
+        self._event = Event()
+
+    def __getattr__(self, name):
+        """Return a handler for `name` that updates the mirror and the UI.
+
+        Events that neither the mirror nor the UI handle are ignored, as
+        they don't change the mirrored screen.
+        """
+        if not name.startswith('_nvim_'):
+            raise AttributeError(name)
+        own = getattr(self, '_mirror_' + name[6:], None)
+        inner = getattr(self._ui, name, None) if self._ui else None
+
+        def handler(*args):
+            if own:
+                own(*args)
+            if inner:
+                inner(*args)
+        return handler
+
+    @property
+    def frame_stats(self):
+        """Frame statistics of the mirrored UI."""
+        return getattr(self._ui, 'frame_stats', None)
+
+    def start(self, bridge):
+        """Start serving viewers and the UI event loop."""
+        self._bridge = bridge
+        if os.path.exists(self._path):
+            # only replace sockets left behind by a mirror that didn't exit
+            # cleanly
+            if not stat.S_ISSOCK(os.stat(self._path).st_mode):
+                raise Exception('{0} exists and is not a socket'.format(
+                    self._path))
+            if is_listening(self._path):
+                raise Exception('{0} is already in use'.format(self._path))
+            os.unlink(self._path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self._path)
+        os.chmod(self._path, 0o600)
+        self._server.listen(16)
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        t = Thread(target=self._serve)
+        t.daemon = True
+        t.start()
+        try:
+            if self._ui:
+                self._ui.start(bridge)
+            else:
+                bridge.attach(self._size[0], self._size[1], True)
+                self._run()
+        finally:
+            self._quit = True
+            self._wakeup()
+            t.join()
+            os.unlink(self._path)
+
+    def quit(self):
+        """Exit the UI event loop."""
+        if self._ui:
+            self._ui.quit()
+        else:
+            self._quit = True
+            self._event.set()
+
+    def schedule_screen_update(self, apply_updates):
+        """Schedule screen updates to run in the UI event loop."""
+        def wrapper():
+            with self._lock:
+                apply_updates()
+                self._publish()
+        if self._ui:
+            self._ui.schedule_screen_update(wrapper)
+        else:
+            with self._lock:
+                self._queue.append(wrapper)
+            self._event.set()
+
+    def _run(self):
+        while not self._quit:
+            self._event.wait()
+            self._event.clear()
+            with self._lock:
+                updates = self._queue
+                self._queue = []
+            for apply_updates in updates:
+                apply_updates()
+
+    def _publish(self):
+        if not self._dirty and not self._cursor_moved:
+            return
+        for viewer in self._viewers:
+            viewer.dirty |= self._dirty
+            viewer.cursor = True
+        self._dirty = set()
+        self._cursor_moved = False
+        self._wakeup()
+
+    def _invalidate(self):
+        for viewer in self._viewers:
+            viewer.snapshot = True
+        self._cursor_moved = True
+
+    def _mirror_resize(self, columns, rows):
+        self._screen = Screen(columns, rows)
+        self._invalidate()
+
+    def _mirror_clear(self):
+        screen = self._screen
+        screen.clear()
+        self._dirty.update(range(screen.top, screen.bot + 1))
+
+    def _mirror_eol_clear(self):
+        self._screen.eol_clear()
+        self._dirty.add(self._screen.row)
+
+    def _mirror_cursor_goto(self, row, col):
+        self._screen.cursor_goto(row, col)
+        self._cursor_moved = True
+
+    def _mirror_set_scroll_region(self, top, bot, left, right):
+        self._screen.set_scroll_region(top, bot, left, right)
+
+    def _mirror_scroll(self, count):
+        screen = self._screen
+        screen.scroll(count)
+        self._dirty.update(range(screen.top, screen.bot + 1))
+
+    def _mirror_highlight_set(self, attrs):
+        key = tuple(sorted(attrs.items())) if attrs else None
+        hl = self._highlight_ids.get(key, None)
+        if hl is None:
+            hl = len(self._highlights)
+            self._highlights.append(dict(key))
+            self._highlight_ids[key] = hl
+        self._attrs = hl
+
+    def _mirror_put(self, text):
+        self._dirty.add(self._screen.row)
+        self._screen.put(text, self._attrs)
+
+    def _mirror_update_fg(self, fg):
+        self._foreground = fg
+        self._invalidate()
+
+    def _mirror_update_bg(self, bg):
+        self._background = bg
+        self._invalidate()
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_w, b'.')
+        except OSError:
+            pass
+
+    def _serve(self):
+        while not self._quit:
+            with self._lock:
+                viewers = list(self._viewers)
+            rlist = [self._server, self._wakeup_r]
+            rlist.extend(v.sock for v in viewers)
+            wlist = [v.sock for v in viewers if v.buf]
+            readable, writable, _ = select.select(rlist, wlist, [])
+            if self._wakeup_r in readable:
+                os.read(self._wakeup_r, 4096)
+            if self._server in readable:
+                sock, _ = self._server.accept()
+                sock.setblocking(False)
+                with self._lock:
+                    self._viewers.append(Viewer(sock))
+                # send the snapshot on the next iteration
+                self._wakeup()
+            for viewer in viewers:
+                if viewer.sock in readable and not self._read(viewer):
+                    self._disconnect(viewer)
+                    continue
+                if not viewer.buf:
+                    with self._lock:
+                        viewer.buf = self._encode(viewer)
+                if viewer.buf and not self._write(viewer):
+                    self._disconnect(viewer)
+        for viewer in self._viewers:
+            viewer.sock.close()
+        self._server.close()
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+
+    def _read(self, viewer):
+        # Viewers are read-only, anything they send is discarded
+        try:
+            return bool(viewer.sock.recv(4096))
+        except socket.error as e:
+            return e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK)
+
+    def _write(self, viewer):
+        try:
+            sent = viewer.sock.send(viewer.buf)
+        except socket.error as e:
+            return e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK)
+        viewer.buf = viewer.buf[sent:]
+        return True
+
+    def _disconnect(self, viewer):
+        viewer.sock.close()
+        with self._lock:
+            self._viewers.remove(viewer)
+
+    def _encode(self, viewer):
+        """Return the message that brings `viewer` up to date, if any."""
+        screen = self._screen
+        if not screen or not (viewer.snapshot or viewer.dirty or
+                              viewer.cursor):
+            return b''
+        if len(viewer.dirty) == screen.rows:
+            viewer.snapshot = True
+        highlights = range(viewer.highlights, len(self._highlights))
+        msg = {
+            'cursor': [screen.row, screen.col],
+            'highlights': dict((i, self._highlights[i]) for i in highlights),
+        }
+        viewer.highlights = len(self._highlights)
+        if viewer.snapshot:
+            msg['type'] = 'snapshot'
+            msg['columns'] = screen.columns
+            msg['rows'] = screen.rows
+            msg['foreground'] = self._foreground
+            msg['background'] = self._background
+            msg['lines'] = [_encode_row(screen, row)
+                            for row in range(screen.rows)]
+        else:
+            msg['type'] = 'damage'
+            msg['lines'] = dict((row, _encode_row(screen, row))
+                                for row in viewer.dirty)
+        viewer.snapshot = False
+        viewer.dirty = set()
+        viewer.cursor = False
+        return json.dumps(msg, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+class MirrorViewer(object):
+
+    """Client that rebuilds the mirrored screen from a `MirrorUI` socket."""
+
+    def __init__(self, path):
+        """Connect to the mirror listening on `path`."""
+        self.screen = None
+        self.foreground = -1
+        self.background = -1
+        self.highlights = {0: None}
+        self.messages = 0
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+        self._buf = b''
+
+    def close(self):
+        """Disconnect from the mirror."""
+        self._sock.close()
+
+    def process(self, timeout=None):
+        """Wait up to `timeout` for messages and apply them.
+
+        Returns the number of messages applied, or None if the mirror closed
+        the connection.
+        """
+        if not select.select([self._sock], [], [], timeout)[0]:
+            return 0
+        data = self._sock.recv(65536)
+        if not data:
+            return None
+        self._buf += data
+        count = 0
+        while b'\n' in self._buf:
+            line, self._buf = self._buf.split(b'\n', 1)
+            self._apply(json.loads(line.decode('utf-8')))
+            count += 1
+        self.messages += count
+        return count
+
+    def text(self):
+        """Return the text of the mirrored screen."""
+        screen = self.screen
+        if not screen:
+            return ''
+        return '\n'.join(''.join(screen.get_cell(row, col)[0]
+                                 for col in range(screen.columns))
+                         for row in range(screen.rows))
+
+    def _apply(self, msg):
+        for hl, attrs in msg['highlights'].items():
+            self.highlights[int(hl)] = attrs
+        if msg['type'] == 'snapshot':
+            self.screen = Screen(msg['columns'], msg['rows'])
+            self.foreground = msg['foreground']
+            self.background = msg['background']
+            lines = enumerate(msg['lines'])
+        else:
+            lines = ((int(row), runs) for row, runs in msg['lines'].items())
+        for row, runs in lines:
+            for col, hl, texts in runs:
+                attrs = self.highlights[hl]
+                for text in texts:
+                    self.screen.cursor_goto(row, col)
+                    self.screen.put(text, attrs)
+                    col += 1
+        self.screen.cursor_goto(*msg['cursor'])
+
+
+def _encode_row(screen, row):
+    runs = []
+    texts = []
+    start = 0
+    hl = None
+    for col in range(screen.columns):
+        text, attrs = screen.get_cell(row, col)
+        if attrs != hl and texts:
+            runs.append(_encode_run(start, hl, texts))
+            texts = []
+        if not texts:
+            start = col
+            hl = attrs
+        texts.append(text)
+    if texts:
+        runs.append(_encode_run(start, hl, texts))
+    return runs
+
+
+def _encode_run(col, hl, texts):
+    if all(len(text) == 1 for text in texts):
+        return [col, hl or 0, ''.join(texts)]
+    return [col, hl or 0, texts]
+
+
+def main():
+    """Print the text of a mirrored session every time it changes."""
+    viewer = MirrorViewer(sys.argv[1])
+    try:
+        while viewer.process() is not None:
+            sys.stdout.write('\x1b[H\x1b[2J' + viewer.text())
+            sys.stdout.flush()
+    finally:
+        viewer.close()
+
+
+if __name__ == '__main__':
+    main()
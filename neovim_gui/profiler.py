@@ -0,0 +1,128 @@
+"""Profiling of the nvim event loop and UI threads."""
+import cProfile
+import os
+import pstats
+import sys
+import threading
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+__all__ = ('Profiler',)
+
+
+class Profiler(object):
+
+    """Profile every thread that calls `enable` while the profiler runs.
+
+    cProfile only hooks the calling thread, so each thread that should be
+    profiled calls `enable`/`disable` itself. When stopped, the stats are
+    written to `<output>-<n>.pstats`(all threads) and
+    `<output>-<n>-<thread>.pstats`, where `n` counts the profiling runs.
+    With `collapsed`, a sampling thread additionally records the stacks of
+    all threads in the collapsed format used by flame graph tools into
+    `<output>-<n>.collapsed`.
+    """
+
+    def __init__(self, sort=None, output=None, collapsed=False,
+                 paused=False, interval=0.005):
+        """Initialize the Profiler instance."""
+        self.sort = sort
+        self.output = output
+        self.collapsed = collapsed
+        self.paused = paused
+        self.interval = interval
+        self.running = False
+        self._runs = 0
+        self._profiles = {}
+        self._stacks = {}
+        self._sampler = None
+        self._sampler_stop = threading.Event()
+
+    def start(self):
+        """Start a profiling run."""
+        self.running = True
+        self._profiles = {}
+        self._stacks = {}
+        if self.collapsed and self.output:
+            self._sampler_stop.clear()
+            self._sampler = threading.Thread(target=self._sample,
+                                             name='profiler')
+            self._sampler.daemon = True
+            self._sampler.start()
+
+    def enable(self):
+        """Start profiling the calling thread."""
+        name = threading.current_thread().name
+        if not self.running or name in self._profiles:
+            return
+        pr = cProfile.Profile()
+        try:
+            pr.enable()
+        except ValueError:
+            # Since python 3.12 there can only be one active profiler, which
+            # sees all threads.
+            return
+        self._profiles[name] = pr
+
+    def disable(self):
+        """Stop profiling the calling thread."""
+        pr = self._profiles.get(threading.current_thread().name)
+        if pr:
+            pr.disable()
+
+    def stop(self):
+        """Stop the profiling run and write the results.
+
+        Returns the top 30 functions sorted by `sort`, or None if no sort
+        order was given.
+        """
+        self.running = False
+        if self._sampler:
+            self._sampler_stop.set()
+            self._sampler.join()
+            self._sampler = None
+        self._runs += 1
+        prefix = '{0}-{1}'.format(self.output, self._runs)
+        s = StringIO()
+        stats = None
+        for name, pr in sorted(self._profiles.items()):
+            if self.output:
+                pr.dump_stats('{0}-{1}.pstats'.format(prefix, name))
+            if stats is None:
+                stats = pstats.Stats(pr, stream=s)
+            else:
+                stats.add(pr)
+        if stats and self.output:
+            stats.dump_stats(prefix + '.pstats')
+        if self._stacks:
+            with open(prefix + '.collapsed', 'w') as f:
+                for stack, count in sorted(self._stacks.items()):
+                    f.write('{0} {1}\n'.format(stack, count))
+        if self.output:
+            sys.stderr.write('profile written to {0}.*\n'.format(prefix))
+        if not stats or not self.sort:
+            return None
+        stats.strip_dirs().sort_stats(self.sort).print_stats(30)
+        return s.getvalue()
+
+    def _sample(self):
+        me = threading.current_thread().ident
+        while not self._sampler_stop.wait(self.interval):
+            names = dict((t.ident, t.name) for t in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame:
+                    code = frame.f_code
+                    stack.append('{0} ({1}:{2})'.format(
+                        code.co_name, os.path.basename(code.co_filename),
+                        code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ';'.join(reversed(stack))
+                self._stacks[key] = self._stacks.get(key, 0) + 1
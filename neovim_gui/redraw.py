@@ -0,0 +1,195 @@
+"""Decoding of redraw notifications.
+
+With python 3, wrapping the session in a `DecodeHook` walks every redraw
+notification and decodes each string in it, including the event names,
+which are then concatenated with `_nvim_` to find the UI handler for every
+update. `RedrawDecoder` only decodes what the UI needs:
+
+- Event names are mapped once to interned handler names.
+- `put` texts are decoded once and short ones, which are almost always a
+  single character, are shared through a cache.
+- Each distinct `highlight_set` attribute map is decoded once, identical
+  maps are passed to the UI as the same dict.
+- Events with only numeric arguments are passed untouched.
+
+Redraw notifications recorded with `pynvim --record-redraw PATH` can be
+replayed to compare both approaches:
+
+    python -m neovim_gui.redraw PATH [REPEAT]
+"""
+import sys
+import time
+
+import msgpack
+
+from neovim.compat import IS_PYTHON3
+
+try:
+    from sys import intern
+except ImportError:
+    pass
+
+
+__all__ = ('RedrawDecoder',)
+
+
+NUMERIC_EVENTS = frozenset([
+    'resize', 'clear', 'eol_clear', 'cursor_goto', 'update_fg', 'update_bg',
+    'update_sp', 'set_scroll_region', 'scroll', 'bell', 'visual_bell',
+    'mouse_on', 'mouse_off', 'busy_start', 'busy_stop', 'flush',
+])
+MAX_CACHED_TEXT = 4
+
+
+class RedrawDecoder(object):
+
+    """Convert redraw notifications into calls of UI handlers."""
+
+    def __init__(self, decode=IS_PYTHON3):
+        """Initialize the RedrawDecoder instance.
+
+        Strings are only decoded if `decode` is True.
+        """
+        self._decode = decode
+        self._events = {}
+        self._texts = {}
+        self._highlights = {}
+
+    def decode(self, updates):
+        """Return the (handler name, calls) pairs of a redraw notification.
+
+        Each call is the sequence of arguments to pass to the handler.
+        """
+        events = self._events
+        rv = []
+        for update in updates:
+            event = events.get(update[0], None)
+            if event is None:
+                event = self._add_event(update[0])
+            name, decode_calls = event
+            calls = update[1:]
+            rv.append((name, decode_calls(calls) if decode_calls else calls,))
+        return rv
+
+    def _add_event(self, raw):
+        event = _decode_obj(raw) if self._decode else raw
+        decode_calls = None
+        if event == 'put':
+            decode_calls = self._decode_put
+        elif event == 'highlight_set':
+            decode_calls = self._decode_highlight_set
+        elif self._decode and event not in NUMERIC_EVENTS:
+            decode_calls = _decode_calls
+        rv = (intern(str('_nvim_' + event)), decode_calls,)
+        self._events[raw] = rv
+        return rv
+
+    def _decode_put(self, calls):
+        texts = self._texts
+        rv = []
+        for args in calls:
+            text = texts.get(args[0], None)
+            if text is None:
+                text = self._add_text(args[0])
+            rv.append((text,))
+        return rv
+
+    def _add_text(self, raw):
+        text = _decode_obj(raw) if self._decode else raw
+        if len(raw) <= MAX_CACHED_TEXT:
+            self._texts[raw] = text
+        return text
+
+    def _decode_highlight_set(self, calls):
+        highlights = self._highlights
+        rv = []
+        for args in calls:
+            key = tuple(sorted(args[0].items()))
+            attrs = highlights.get(key, None)
+            if attrs is None:
+                attrs = _decode_obj(args[0]) if self._decode else args[0]
+                highlights[key] = attrs
+            rv.append((attrs,))
+        return rv
+
+
+def _decode_calls(calls):
+    return [_decode_obj(args) for args in calls]
+
+
+def _decode_obj(obj):
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8', 'replace')
+    if isinstance(obj, (list, tuple)):
+        return [_decode_obj(o) for o in obj]
+    if isinstance(obj, dict):
+        return dict((_decode_obj(k), _decode_obj(v),) for k, v in obj.items())
+    return obj
+
+
+def record(f, updates):
+    """Append the raw redraw notification `updates` to the file `f`."""
+    f.write(msgpack.packb(updates, use_bin_type=False))
+
+
+def load(path):
+    """Return the raw redraw notifications recorded in `path`."""
+    with open(path, 'rb') as f:
+        return list(msgpack.Unpacker(f, raw=True))
+
+
+class _NullUI(object):
+    def __getattr__(self, name):
+        def handler(*args):
+            pass
+        setattr(self, name, handler)
+        return handler
+
+
+def _replay_blanket(notifications, ui):
+    for updates in notifications:
+        if IS_PYTHON3:
+            updates = _decode_obj(updates)
+        for update in updates:
+            handler = getattr(ui, '_nvim_' + update[0])
+            for args in update[1:]:
+                handler(*args)
+
+
+def _replay_selective(notifications, ui):
+    decoder = RedrawDecoder()
+    handlers = {}
+    for updates in notifications:
+        for name, calls in decoder.decode(updates):
+            handler = handlers.get(name, None)
+            if handler is None:
+                handler = handlers[name] = getattr(ui, name)
+            for args in calls:
+                handler(*args)
+
+
+def main():
+    """Print the decoding overhead of a recorded trace per event."""
+    notifications = load(sys.argv[1])
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    count = sum(len(update) - 1 for updates in notifications
+                for update in updates)
+    print('{0} events in {1} notifications'.format(count,
+                                                   len(notifications)))
+    if not count:
+        return
+    ui = _NullUI()
+    for name, replay in (('blanket', _replay_blanket),
+                         ('selective', _replay_selective),):
+        best = None
+        for _ in range(repeat):
+            start = time.time()
+            replay(notifications, ui)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print('{0}: {1:.1f} ms total, {2:.0f} ns/event'.format(
+            name, best * 1000, best * 1e9 / count))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,36 @@
 """Common code for graphical and text UIs."""
+import json
+import struct
+import sys
+from array import array
+
 from neovim.compat import IS_PYTHON3
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
-__all__ = ('Screen',)
+__all__ = ('Screen', 'diff_snapshots')
 
 
 if not IS_PYTHON3:
     range = xrange  # NOQA
 
 
+# Snapshot layout: header, json encoded highlight/string tables, codepoint
+# plane(uint32 per cell) and attribute id plane(uint16 per cell). Planes are
+# stored row-major in little endian byte order.
+SNAPSHOT_MAGIC = b'NVS1'
+SNAPSHOT_HEADER = struct.Struct('<4sHHHHI')
+# Codepoint plane values with this bit set are indexes into the string table,
+# used for cells that don't hold exactly one codepoint(eg: combining chars).
+# The right half of double width glyphs is stored as 0.
+STRING_FLAG = 0x80000000
+STRING_MASK = STRING_FLAG - 1
+
+
 class Cell(object):
     def __init__(self):
         self.text = ' '
@@ -126,9 +148,199 @@ class Screen(object):
             if buf:
                 yield row, curcol, ''.join(buf), attrs
 
+    def snapshot(self):
+        """Serialize the screen contents into a compact binary snapshot.
+
+        Attributes must be json serializable, lists are restored as tuples.
+        """
+        highlights = [None]
+        highlight_ids = {None: 0}
+        strings = []
+        string_ids = {}
+        codepoints = array('I')
+        attr_ids = array('H')
+        for row in self._cells:
+            for cell in row:
+                text, attrs = cell.text, cell.attrs
+                if len(text) == 1:
+                    codepoints.append(ord(text))
+                elif not text:
+                    codepoints.append(0)
+                else:
+                    sid = string_ids.get(text, None)
+                    if sid is None:
+                        sid = string_ids[text] = len(strings)
+                        strings.append(text)
+                    codepoints.append(STRING_FLAG | sid)
+                key = _attrs_key(attrs)
+                hl = highlight_ids.get(key, None)
+                if hl is None:
+                    hl = highlight_ids[key] = len(highlights)
+                    highlights.append(attrs)
+                attr_ids.append(hl)
+        tables = json.dumps({'highlights': highlights, 'strings': strings},
+                            separators=(',', ':')).encode('utf-8')
+        if sys.byteorder != 'little':
+            codepoints.byteswap()
+            attr_ids.byteswap()
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self.rows, self.columns,
+                                      self.row, self.col, len(tables))
+        return b''.join([header, tables, _tobytes(codepoints),
+                         _tobytes(attr_ids)])
+
+    @classmethod
+    def from_snapshot(cls, data):
+        """Create a Screen from a snapshot returned by `snapshot`."""
+        rows, columns, row, col, highlights, strings, codepoints, attr_ids = \
+            _parse_snapshot(data)
+        screen = cls(columns, rows)
+        screen.cursor_goto(row, col)
+        i = 0
+        for r in screen._cells:
+            for cell in r:
+                cp = codepoints[i]
+                if cp & STRING_FLAG:
+                    text = strings[cp & STRING_MASK]
+                else:
+                    text = _unichr(cp) if cp else ''
+                cell.set(text, highlights[attr_ids[i]])
+                i += 1
+        return screen
+
     def _clear_region(self, top, bot, left, right):
         for rownum in range(top, bot + 1):
             row = self._cells[rownum]
             for colnum in range(left, right + 1):
                 cell = row[colnum]
                 cell.set(' ', None)
+
+
+def diff_snapshots(old, new):
+    """Compare two snapshots of screens with the same size.
+
+    Returns a list of `(row, spans)` for each row that changed, where spans
+    is a list of `(startcol, endcol)` ranges(endcol exclusive) of cells whose
+    text or attributes differ. The comparison is vectorized with NumPy when
+    it is available.
+    """
+    a = _parse_snapshot(old)
+    b = _parse_snapshot(new)
+    if a[:2] != b[:2]:
+        raise ValueError('Snapshots have different sizes')
+    rows, columns = a[:2]
+    # Highlight and string ids are local to each snapshot, translate the
+    # ids of the new snapshot to the ids of the old one.
+    hl_map = _id_map(a[4], b[4])
+    str_map = _id_map(a[5], b[5])
+    if numpy is not None:
+        return _diff_numpy(rows, columns, a[6], a[7], b[6], b[7], hl_map,
+                           str_map)
+    rv = []
+    cps_a, attrs_a, cps_b, attrs_b = a[6], a[7], b[6], b[7]
+    for row in range(rows):
+        spans = []
+        start = None
+        base = row * columns
+        for col in range(columns + 1):
+            changed = False
+            if col < columns:
+                i = base + col
+                cp = cps_b[i]
+                if cp & STRING_FLAG:
+                    cp = STRING_FLAG | str_map[cp & STRING_MASK]
+                changed = (cps_a[i] != cp or
+                           attrs_a[i] != hl_map[attrs_b[i]])
+            if changed and start is None:
+                start = col
+            elif not changed and start is not None:
+                spans.append((start, col,))
+                start = None
+        if spans:
+            rv.append((row, spans,))
+    return rv
+
+
+def _diff_numpy(rows, columns, cps_a, attrs_a, cps_b, attrs_b, hl_map,
+                str_map):
+    cps_a = numpy.frombuffer(cps_a, dtype='<u4').reshape(rows, columns)
+    attrs_a = numpy.frombuffer(attrs_a, dtype='<u2').reshape(rows, columns)
+    cps_b = numpy.frombuffer(cps_b, dtype='<u4').reshape(rows, columns)
+    attrs_b = numpy.frombuffer(attrs_b, dtype='<u2').reshape(rows, columns)
+    strings = (cps_b & STRING_FLAG) != 0
+    if strings.any():
+        cps_b = cps_b.copy()
+        str_map = numpy.array(str_map, dtype='<u4')
+        cps_b[strings] = STRING_FLAG | str_map[cps_b[strings] & STRING_MASK]
+    attrs_b = numpy.array(hl_map, dtype='<u4')[attrs_b]
+    changed = (cps_a != cps_b) | (attrs_a != attrs_b)
+    rv = []
+    for row in numpy.flatnonzero(changed.any(axis=1)):
+        # the edges of changed spans are where the padded mask flips
+        edges = numpy.flatnonzero(numpy.diff(numpy.concatenate(
+            ([False], changed[row], [False]))))
+        rv.append((int(row), [(int(s), int(e),)
+                              for s, e in zip(edges[::2], edges[1::2])]))
+    return rv
+
+
+def _parse_snapshot(data):
+    magic, rows, columns, row, col, tables_len = \
+        SNAPSHOT_HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError('Invalid screen snapshot')
+    offset = SNAPSHOT_HEADER.size
+    tables = json.loads(data[offset:offset + tables_len].decode('utf-8'))
+    offset += tables_len
+    cells = rows * columns
+    codepoints = array('I')
+    _frombytes(codepoints, data[offset:offset + cells * 4])
+    offset += cells * 4
+    attr_ids = array('H')
+    _frombytes(attr_ids, data[offset:offset + cells * 2])
+    if sys.byteorder != 'little':
+        codepoints.byteswap()
+        attr_ids.byteswap()
+    highlights = [_freeze(h) for h in tables['highlights']]
+    return (rows, columns, row, col, highlights, tables['strings'],
+            codepoints, attr_ids)
+
+
+def _id_map(old_table, new_table):
+    """Map the ids of `new_table` to the ids of equal items in `old_table`.
+
+    Items missing from `old_table` get ids that don't exist in it.
+    """
+    ids = dict((_attrs_key(item), i) for i, item in enumerate(old_table))
+    rv = []
+    missing = len(old_table)
+    for item in new_table:
+        i = ids.get(_attrs_key(item), None)
+        if i is None:
+            i = missing
+            missing += 1
+        rv.append(i)
+    return rv
+
+
+def _attrs_key(attrs):
+    if isinstance(attrs, dict):
+        return tuple(sorted(attrs.items()))
+    return attrs
+
+
+def _freeze(obj):
+    if isinstance(obj, list):
+        return tuple(_freeze(o) for o in obj)
+    if isinstance(obj, dict):
+        return dict((k, _freeze(v)) for k, v in obj.items())
+    return obj
+
+
+if IS_PYTHON3:
+    _unichr = chr
+    _tobytes = array.tobytes
+    _frombytes = array.frombytes
+else:
+    _unichr = unichr  # NOQA
+    _tobytes = array.tostring
+    _frombytes = array.fromstring
@@ -0,0 +1,169 @@
+"""Framebuffer shared with other processes through a memory mapped file.
+
+The file starts with a header page followed by the pixels, stored as a
+cairo RGB24 image(32 bits per pixel, native endian, top byte unused):
+
+    magic      4s   b'NVFB'
+    version    u32
+    seq        u32  odd while a frame is being drawn
+    width      u32
+    height     u32
+    stride     u32
+    nrects     u32  number of valid dirty rects
+    rects      MAX_RECTS * (x u32, y u32, width u32, height u32)
+
+All header fields are little endian. The dirty rects list the regions that
+changed in the frame that ended with `seq`. Readers that missed frames
+(`seq` advanced by more than 2) must read the whole image. When the UI is
+resized the file is atomically replaced, readers detect this by checking the
+inode of the path. The file holds the rendered editor contents, so it is
+only readable by the user.
+"""
+import mmap
+import os
+import struct
+import tempfile
+
+import cairo
+
+
+__all__ = ('SharedFramebuffer', 'FramebufferReader')
+
+
+MAGIC = b'NVFB'
+VERSION = 1
+HEADER = struct.Struct('<4s6I')
+RECT = struct.Struct('<4I')
+MAX_RECTS = 200
+HEADER_SIZE = mmap.PAGESIZE * (
+    (HEADER.size + RECT.size * MAX_RECTS) // mmap.PAGESIZE + 1)
+SEQ_OFFSET = 8
+
+
+class SharedFramebuffer(object):
+
+    """Cairo image surface backed by a shared memory file."""
+
+    def __init__(self, path):
+        """Initialize the SharedFramebuffer instance."""
+        self._path = path
+        self._mmap = None
+        self._seq = 0
+        self._rects = []
+        self._width = self._height = 0
+
+    def resize(self, width, height):
+        """Replace the framebuffer file and return a surface drawing to it."""
+        stride = cairo.ImageSurface.format_stride_for_width(
+            cairo.FORMAT_RGB24, width)
+        size = HEADER_SIZE + stride * height
+        # a unique file, so a symlink planted at a predictable path can't
+        # redirect the write
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self._path)),
+            prefix=os.path.basename(self._path) + '.')
+        try:
+            with os.fdopen(fd, 'w+b') as f:
+                f.truncate(size)
+                framebuffer = mmap.mmap(f.fileno(), size)
+            # readers take the whole image after a resize
+            HEADER.pack_into(framebuffer, 0, MAGIC, VERSION, self._seq, width,
+                             height, stride, 0)
+            os.rename(tmp_path, self._path)
+        except (IOError, OSError):
+            os.unlink(tmp_path)
+            raise
+        self._mmap = framebuffer
+        self._width, self._height = width, height
+        self._rects = []
+        return cairo.ImageSurface.create_for_data(
+            memoryview(self._mmap)[HEADER_SIZE:], cairo.FORMAT_RGB24, width,
+            height, stride)
+
+    def close(self):
+        """Unmap and remove the framebuffer file."""
+        if self._mmap:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # still exported to a surface, unmapped once it is freed
+                pass
+            self._mmap = None
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+
+    def begin_frame(self):
+        """Mark the start of a frame, readers must not trust the pixels."""
+        if not self._seq % 2:
+            self._seq += 1
+            if self._mmap:
+                struct.pack_into('<I', self._mmap, SEQ_OFFSET, self._seq)
+
+    def damage(self, x, y, width, height):
+        """Add a dirty rect to the current frame."""
+        self._rects.append((int(x), int(y), int(width), int(height),))
+
+    def end_frame(self):
+        """Publish the dirty rects and mark the frame as complete."""
+        if not self._seq % 2:
+            return
+        rects = self._rects
+        self._rects = []
+        self._seq += 1
+        if not self._mmap:
+            return
+        if len(rects) > MAX_RECTS:
+            rects = [(0, 0, self._width, self._height,)]
+        for i, rect in enumerate(rects):
+            RECT.pack_into(self._mmap, HEADER.size + i * RECT.size, *rect)
+        struct.pack_into('<I', self._mmap, HEADER.size - 4, len(rects))
+        struct.pack_into('<I', self._mmap, SEQ_OFFSET, self._seq)
+
+
+class FramebufferReader(object):
+
+    """Read frames published by a `SharedFramebuffer`."""
+
+    def __init__(self, path):
+        """Initialize the FramebufferReader instance."""
+        self._path = path
+        self._inode = None
+        self._mmap = None
+        self.seq = 0
+
+    def poll(self):
+        """Return the dirty rects of a new frame, or None if there is none.
+
+        When frames were missed or the framebuffer was resized, the whole
+        image is returned as a single rect. The pixels of the frame must be
+        read from `pixels` before calling `consistent`, which tells if they
+        may have been modified meanwhile.
+        """
+        inode = os.stat(self._path).st_ino
+        resized = inode != self._inode
+        if resized:
+            with open(self._path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._inode = inode
+        (magic, version, seq, self.width, self.height, self.stride,
+         nrects) = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Invalid framebuffer')
+        if seq % 2 or (seq == self.seq and not resized):
+            return None
+        if resized or seq != self.seq + 2:
+            rects = [(0, 0, self.width, self.height,)]
+        else:
+            rects = [RECT.unpack_from(self._mmap, HEADER.size + i * RECT.size)
+                     for i in range(nrects)]
+        self.seq = seq
+        return rects
+
+    @property
+    def pixels(self):
+        """Zero-copy view of the pixel data."""
+        return memoryview(self._mmap)[HEADER_SIZE:]
+
+    def consistent(self):
+        """Return True if no frame started since the last `poll`."""
+        return struct.unpack_from('<I', self._mmap, SEQ_OFFSET)[0] == self.seq
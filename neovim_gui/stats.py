@@ -0,0 +1,63 @@
+"""Frame statistics shared by the UI implementations."""
+
+
+__all__ = ('FrameStats',)
+
+
+class FrameStats(object):
+
+    """Collect statistics about the frames presented by a UI.
+
+    A frame is late when its timer fired more than half a frame interval
+    after the deadline it was scheduled for, and every full interval of
+    lateness is counted as a dropped frame.
+    """
+
+    def __init__(self, frame_interval):
+        """Initialize the FrameStats instance."""
+        self.frame_interval = frame_interval
+        self.frames = 0
+        self.batches = 0
+        self.late_frames = 0
+        self.dropped_frames = 0
+        self.max_lateness = 0.0
+        self.frame_time = 0.0
+        self.max_frame_time = 0.0
+        self.bytes = 0
+        self.max_bytes = 0
+
+    def record(self, batches, lateness, frame_time, nbytes=0):
+        """Record a frame that applied `batches` redraw batches.
+
+        `nbytes` is the size of the output emitted for the frame, for UIs
+        that write to a stream.
+        """
+        self.frames += 1
+        self.bytes += nbytes
+        self.max_bytes = max(self.max_bytes, nbytes)
+        self.batches += batches
+        self.frame_time += frame_time
+        self.max_frame_time = max(self.max_frame_time, frame_time)
+        self.max_lateness = max(self.max_lateness, lateness)
+        interval = self.frame_interval
+        if interval and lateness > interval / 2.0:
+            self.late_frames += 1
+            self.dropped_frames += int(lateness / interval)
+
+    def __str__(self):
+        """Format the statistics as a short report."""
+        frames = self.frames or 1
+        lines = [
+            'frames: {0}'.format(self.frames),
+            'redraw batches: {0} ({1:.2f} per frame)'.format(
+                self.batches, self.batches / float(frames)),
+            'late frames: {0}'.format(self.late_frames),
+            'dropped frames: {0}'.format(self.dropped_frames),
+            'max lateness: {0:.2f}ms'.format(self.max_lateness * 1000),
+            'frame time: {0:.2f}ms avg, {1:.2f}ms max'.format(
+                self.frame_time * 1000 / frames, self.max_frame_time * 1000),
+        ]
+        if self.bytes:
+            lines.append('bytes: {0} ({1:.1f} avg, {2} max per frame)'.format(
+                self.bytes, self.bytes / float(frames), self.max_bytes))
+        return '\n'.join(lines)
@@ -0,0 +1,571 @@
+"""Neovim terminal UI.
+
+The screen is rendered by diffing it against the last frame written to the
+terminal, so only changed cells are emitted. Cursor movements use the
+shortest escape sequence available, SGR sequences are only emitted when the
+attributes change and full-width scrolls are performed by the terminal
+through its scroll region. This keeps the output volume low, which is what
+matters on slow links.
+"""
+import codecs
+import os
+import select
+import signal
+import sys
+import termios
+import tty
+from threading import Lock
+
+from .screen import Screen
+from .stats import FrameStats
+
+try:
+    from time import monotonic
+except ImportError:
+    # python 2
+    from time import time as monotonic
+
+
+__all__ = ('TtyUI',)
+
+
+# Keys sent by common terminals as CSI(ESC [) or SS3(ESC O) sequences,
+# by final byte. Modified keys carry the modifiers as second parameter.
+FINAL_TABLE = {
+    'A': 'Up',
+    'B': 'Down',
+    'C': 'Right',
+    'D': 'Left',
+    'H': 'Home',
+    'F': 'End',
+    'P': 'F1',
+    'Q': 'F2',
+    'R': 'F3',
+    'S': 'F4',
+    'Z': 'S-Tab',
+}
+
+
+# Keys sent as CSI sequences ending with ~, by first parameter
+TILDE_TABLE = {
+    1: 'Home',
+    2: 'Insert',
+    3: 'Del',
+    4: 'End',
+    5: 'PageUp',
+    6: 'PageDown',
+    7: 'Home',
+    8: 'End',
+    11: 'F1',
+    12: 'F2',
+    13: 'F3',
+    14: 'F4',
+    15: 'F5',
+    17: 'F6',
+    18: 'F7',
+    19: 'F8',
+    20: 'F9',
+    21: 'F10',
+    23: 'F11',
+    24: 'F12',
+}
+
+
+# Modifier bits of the modifier parameter(minus one) and their nvim prefix
+MODIFIERS = ((4, 'C-'), (1, 'S-'), (2, 'A-'), (8, 'D-'),)
+
+
+# Translation table for control characters that have a nvim key name
+CONTROL_TABLE = {
+    '\r': 'CR',
+    '\n': 'NL',
+    '\t': 'Tab',
+    '\x7f': 'BS',
+    '\x08': 'BS',
+    '\x00': 'Nul',
+}
+
+
+# Cleared rows of a scrolled region are marked with this value, it never
+# matches a screen cell so the rows are always redrawn.
+SCROLLED = (None, None)
+
+
+class TtyUI(object):
+
+    """Terminal UI class."""
+
+    def __init__(self, max_fps=60, stdin=None, stdout=None):
+        """Initialize the UI instance.
+
+        Like `GtkUI`, redraw batches are coalesced into at most `max_fps`
+        frames per second.
+        """
+        self._stdin = (stdin or sys.stdin).fileno()
+        self._stdout = (stdout or sys.stdout).fileno()
+        self._foreground = -1
+        self._background = -1
+        self._screen = None
+        self._attrs = None
+        self._busy = False
+        self._insert_cursor = False
+        self._frame = None
+        self._dirty = set()
+        self._scrolls = []
+        self._extra = []
+        self._tcursor = None
+        self._tattrs = False
+        self._tinsert_cursor = False
+        self._tbusy = False
+        self._sgr_cache = {}
+        self._lock = Lock()
+        self._queue = []
+        self._quit = False
+        self._resized = False
+        self._toggle_profile = False
+        self._frame_interval = 1.0 / max_fps if max_fps > 0 else 0
+        self._last_frame = 0
+        self._frame_deadline = 0
+        self._pending_updates = []
+        self.frame_stats = FrameStats(self._frame_interval)
+
+    def start(self, bridge):
+        """Start the UI event loop."""
+        self._bridge = bridge
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        old_mode = termios.tcgetattr(self._stdin)
+        old_handler = signal.signal(signal.SIGWINCH, self._on_sigwinch)
+        old_usr1_handler = signal.signal(signal.SIGUSR1, self._on_sigusr1)
+        tty.setraw(self._stdin)
+        # switch to the alternate screen
+        self._write('\x1b[?1049h')
+        try:
+            columns, rows = self._get_size()
+            bridge.attach(columns, rows, True)
+            self._run()
+        finally:
+            self._write('\x1b[0m\x1b[2 q\x1b[?25h\x1b[?1049l')
+            termios.tcsetattr(self._stdin, termios.TCSADRAIN, old_mode)
+            signal.signal(signal.SIGWINCH, old_handler)
+            signal.signal(signal.SIGUSR1, old_usr1_handler)
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+
+    def quit(self):
+        """Exit the UI event loop."""
+        self._quit = True
+        self._wakeup()
+
+    def schedule_screen_update(self, apply_updates):
+        """Schedule screen updates to run in the UI event loop."""
+        with self._lock:
+            self._queue.append(apply_updates)
+        self._wakeup()
+
+    def _run(self):
+        while not self._quit:
+            timeout = None
+            if self._pending_updates:
+                timeout = max(0, self._frame_deadline - monotonic())
+            try:
+                readable = select.select([self._stdin, self._wakeup_r], [],
+                                         [], timeout)[0]
+            except select.error:
+                # interrupted by SIGWINCH on python 2
+                readable = []
+            if self._wakeup_r in readable:
+                os.read(self._wakeup_r, 4096)
+            with self._lock:
+                queued = self._queue
+                self._queue = []
+            if queued and not self._pending_updates:
+                # paint immediately if the last frame is older than the
+                # frame interval, else wait until the next frame is due
+                self._frame_deadline = max(
+                    monotonic(), self._last_frame + self._frame_interval)
+            self._pending_updates.extend(queued)
+            if self._resized:
+                self._resized = False
+                columns, rows = self._get_size()
+                if self._screen and (columns, rows) != (self._screen.columns,
+                                                        self._screen.rows):
+                    self._bridge.resize(columns, rows)
+            if self._toggle_profile:
+                self._toggle_profile = False
+                self._bridge.toggle_profile()
+            if self._stdin in readable:
+                self._read_input()
+            if self._pending_updates and monotonic() >= self._frame_deadline:
+                self._render_frame()
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_w, b'.')
+        except OSError:
+            # the loop already exited
+            pass
+
+    def _on_sigwinch(self, *args):
+        self._resized = True
+        self._wakeup()
+
+    def _on_sigusr1(self, *args):
+        self._toggle_profile = True
+        self._wakeup()
+
+    def _get_size(self):
+        try:
+            size = os.get_terminal_size(self._stdout)
+            return size.columns, size.lines
+        except (AttributeError, OSError):
+            return 80, 24
+
+    def _read_input(self):
+        data = os.read(self._stdin, 4096)
+        if not data:
+            self._bridge.exit()
+            return
+        keys = _translate_input(self._decoder.decode(data))
+        if keys:
+            if self._bridge.tracer:
+                self._bridge.tracer.key_event()
+            self._bridge.input(keys)
+
+    def _nvim_resize(self, columns, rows):
+        self._screen = Screen(columns, rows)
+        self._frame = None
+        self._scrolls = []
+        self._dirty = set()
+
+    def _nvim_clear(self):
+        self._screen.clear()
+        self._dirty.update(range(self._screen.top, self._screen.bot + 1))
+
+    def _nvim_eol_clear(self):
+        self._screen.eol_clear()
+        self._dirty.add(self._screen.row)
+
+    def _nvim_cursor_goto(self, row, col):
+        self._screen.cursor_goto(row, col)
+
+    def _nvim_busy_start(self):
+        self._busy = True
+
+    def _nvim_busy_stop(self):
+        self._busy = False
+
+    def _nvim_mouse_on(self):
+        pass
+
+    def _nvim_mouse_off(self):
+        pass
+
+    def _nvim_mode_change(self, mode):
+        self._insert_cursor = mode == 'insert'
+
+    def _nvim_set_scroll_region(self, top, bot, left, right):
+        self._screen.set_scroll_region(top, bot, left, right)
+
+    def _nvim_scroll(self, count):
+        screen = self._screen
+        if screen.left == 0 and screen.right == screen.columns - 1:
+            # the terminal can only scroll full-width regions
+            self._scrolls.append((screen.top, screen.bot, count,))
+            # rows edited before the scroll move along with their contents
+            top, bot = screen.top, screen.bot
+            dirty = set()
+            for row in self._dirty:
+                if top <= row <= bot:
+                    row -= count
+                    if not top <= row <= bot:
+                        continue
+                dirty.add(row)
+            self._dirty = dirty
+        else:
+            self._dirty.update(range(screen.top, screen.bot + 1))
+        screen.scroll(count)
+
+    def _nvim_highlight_set(self, attrs):
+        self._attrs = tuple(sorted(attrs.items())) if attrs else None
+
+    def _nvim_put(self, text):
+        self._dirty.add(self._screen.row)
+        self._screen.put(text, self._attrs)
+
+    def _nvim_bell(self):
+        self._extra.append('\x07')
+
+    def _nvim_visual_bell(self):
+        pass
+
+    def _nvim_update_fg(self, fg):
+        self._foreground = fg
+        self._sgr_cache = {}
+        self._tattrs = False
+        self._frame = None
+
+    def _nvim_update_bg(self, bg):
+        self._background = bg
+        self._sgr_cache = {}
+        self._tattrs = False
+        self._frame = None
+
+    def _nvim_suspend(self):
+        pass
+
+    def _nvim_set_title(self, title):
+        self._extra.append('\x1b]2;{0}\x07'.format(title))
+
+    def _nvim_set_icon(self, icon):
+        self._extra.append('\x1b]1;{0}\x07'.format(icon))
+
+    def _render_frame(self):
+        start = monotonic()
+        updates = self._pending_updates
+        self._pending_updates = []
+        for apply_updates in updates:
+            apply_updates()
+        nbytes = self._write(self._render()) if self._screen else 0
+        if self._bridge.tracer:
+            self._bridge.tracer.painted()
+        self._last_frame = start
+        self.frame_stats.record(len(updates),
+                                max(0, start - self._frame_deadline),
+                                monotonic() - start, nbytes)
+
+    def _render(self):
+        """Return the escape sequences that update the terminal."""
+        screen = self._screen
+        out = self._extra
+        self._extra = []
+        if self._busy != self._tbusy:
+            out.append('\x1b[?25l' if self._busy else '\x1b[?25h')
+            self._tbusy = self._busy
+        if self._insert_cursor != self._tinsert_cursor:
+            out.append('\x1b[6 q' if self._insert_cursor else '\x1b[2 q')
+            self._tinsert_cursor = self._insert_cursor
+        if self._frame is None:
+            self._frame = [[SCROLLED] * screen.columns
+                           for _ in range(screen.rows)]
+            self._dirty = set(range(screen.rows))
+            self._scrolls = []
+        for top, bot, count in self._scrolls:
+            self._render_scroll(out, top, bot, count)
+        self._scrolls = []
+        for row in sorted(self._dirty):
+            for left, right in self._diff_row(row):
+                self._render_span(out, row, left, right)
+        self._dirty = set()
+        self._move(out, screen.row, screen.col)
+        return ''.join(out)
+
+    def _render_scroll(self, out, top, bot, count):
+        rows = self._screen.rows
+        if top != 0 or bot != rows - 1:
+            out.append('\x1b[{0};{1}r'.format(top + 1, bot + 1))
+        if count > 0:
+            out.append('\x1b[{0}S'.format(count))
+        else:
+            out.append('\x1b[{0}T'.format(-count))
+        if top != 0 or bot != rows - 1:
+            # resetting the scroll region moves the cursor home
+            out.append('\x1b[r')
+            self._tcursor = (0, 0,)
+        frame = self._frame
+        region = frame[top:bot + 1]
+        blank = [[SCROLLED] * self._screen.columns for _ in range(abs(count))]
+        if count > 0:
+            region = region[count:] + blank
+        else:
+            region = blank + region[:count]
+        frame[top:bot + 1] = region
+        if count > 0:
+            self._dirty.update(range(bot - count + 1, bot + 1))
+        else:
+            self._dirty.update(range(top, top - count))
+
+    def _diff_row(self, row):
+        """Return the spans of `row` that differ from the terminal."""
+        get_cell = self._screen.get_cell
+        old = self._frame[row]
+        spans = []
+        left = right = None
+        for col in range(self._screen.columns):
+            if get_cell(row, col) == old[col]:
+                continue
+            if right is not None and col - right <= 4:
+                # rewriting a few unchanged cells is cheaper than moving
+                right = col
+                continue
+            if right is not None:
+                spans.append((left, right,))
+            left = right = col
+        if right is not None:
+            spans.append((left, right,))
+        return spans
+
+    def _render_span(self, out, row, left, right):
+        screen = self._screen
+        frame_row = self._frame[row]
+        # never start or end a span in the middle of a double width glyph
+        if left > 0 and not screen.get_cell(row, left)[0]:
+            left -= 1
+        if right + 1 < screen.columns and \
+           not screen.get_cell(row, right + 1)[0]:
+            right += 1
+        self._move(out, row, left)
+        for col in range(left, right + 1):
+            cell = screen.get_cell(row, col)
+            frame_row[col] = cell
+            text, attrs = cell
+            if not text:
+                continue
+            if attrs != self._tattrs:
+                out.append(self._get_sgr(attrs))
+                self._tattrs = attrs
+            out.append(text)
+        if right + 1 < screen.columns:
+            self._tcursor = (row, right + 1,)
+        else:
+            # the cursor position after writing the last column depends on
+            # the terminal wrapping behavior
+            self._tcursor = None
+
+    def _move(self, out, row, col):
+        """Append the shortest sequence that moves the cursor to row, col."""
+        cursor = self._tcursor
+        if cursor == (row, col,):
+            return
+        candidates = ['\x1b[{0};{1}H'.format(row + 1, col + 1)]
+        if cursor:
+            crow, ccol = cursor
+            if crow == row:
+                candidates.append('\x1b[{0}G'.format(col + 1))
+                if col == 0:
+                    candidates.append('\r')
+                elif col > ccol:
+                    candidates.append('\x1b[{0}C'.format(col - ccol))
+                elif ccol - col <= 3:
+                    candidates.append('\b' * (ccol - col))
+            elif ccol == col:
+                if row > crow:
+                    candidates.append('\x1b[{0}B'.format(row - crow))
+                else:
+                    candidates.append('\x1b[{0}A'.format(crow - row))
+            elif col == 0 and row > crow:
+                # the terminal is in raw mode, so \n doesn't return the
+                # carriage
+                candidates.append('\r' + '\n' * (row - crow))
+        out.append(min(candidates, key=len))
+        self._tcursor = (row, col,)
+
+    def _get_sgr(self, attrs):
+        rv = self._sgr_cache.get(attrs, None)
+        if rv is None:
+            a = dict(attrs or ())
+            fg = a.get('foreground', self._foreground)
+            bg = a.get('background', self._background)
+            codes = ['0']
+            if a.get('bold'):
+                codes.append('1')
+            if a.get('italic'):
+                codes.append('3')
+            if a.get('underline') or a.get('undercurl'):
+                codes.append('4')
+            if a.get('reverse'):
+                if fg != -1 and bg != -1:
+                    fg, bg = bg, fg
+                else:
+                    codes.append('7')
+            codes.append(_color_code(fg, 38, 39))
+            codes.append(_color_code(bg, 48, 49))
+            rv = '\x1b[' + ';'.join(codes) + 'm'
+            self._sgr_cache[attrs] = rv
+        return rv
+
+    def _write(self, data):
+        data = data.encode('utf-8')
+        written = 0
+        while written < len(data):
+            written += os.write(self._stdout, data[written:])
+        return written
+
+
+def _color_code(color, code, default):
+    if color == -1:
+        return str(default)
+    return '{0};2;{1};{2};{3}'.format(code, (color >> 16) & 0xff,
+                                      (color >> 8) & 0xff, color & 0xff)
+
+
+def _translate_input(data):
+    keys = []
+    i = 0
+    while i < len(data):
+        c = data[i]
+        if c == '\x1b':
+            key, length = _translate_escape(data, i)
+            if key:
+                keys.append(key)
+            i += length
+            continue
+        if c in CONTROL_TABLE:
+            keys.append('<' + CONTROL_TABLE[c] + '>')
+        elif c < ' ':
+            keys.append('<C-' + chr(ord(c) + 96) + '>')
+        elif c == '<':
+            keys.append('<lt>')
+        else:
+            keys.append(c)
+        i += 1
+    return ''.join(keys)
+
+
+def _translate_escape(data, i):
+    """Translate the escape sequence at `i`, returning (key, length).
+
+    The key is None for sequences that don't map to a nvim key, which are
+    dropped.
+    """
+    introducer = data[i + 1:i + 2]
+    if introducer == '[':
+        # parameter and intermediate bytes followed by a final byte
+        end = i + 2
+        while end < len(data) and ' ' <= data[end] <= '?':
+            end += 1
+        if end < len(data) and '@' <= data[end] <= '~':
+            return (_translate_csi(data[i + 2:end], data[end]),
+                    end + 1 - i,)
+        if end == i + 2:
+            return '<A-[>', 2
+        # incomplete sequence
+        return None, end - i
+    if introducer == 'O' and data[i + 2:i + 3] in FINAL_TABLE:
+        return '<' + FINAL_TABLE[data[i + 2]] + '>', 3
+    if introducer and introducer != '\x1b':
+        # Alt sends the key prefixed by escape
+        key = _translate_input(introducer)
+        if key.startswith('<'):
+            key = key[1:-1]
+        return '<A-' + key + '>', 2
+    return '<Esc>', 1
+
+
+def _translate_csi(params, final):
+    try:
+        params = [int(p) if p else 1 for p in params.split(';')]
+    except ValueError:
+        # private sequences, like the ones starting with ? or >
+        return None
+    if final == '~':
+        name = TILDE_TABLE.get(params[0], None)
+    else:
+        name = FINAL_TABLE.get(final, None)
+    modifiers = params[1] if len(params) > 1 else 1
+    if not name:
+        return None
+    prefix = ''.join(p for bit, p in MODIFIERS if (modifiers - 1) & bit)
+    if name.startswith('S-') and 'S-' in prefix:
+        name = name[2:]
+    return '<' + prefix + name + '>'
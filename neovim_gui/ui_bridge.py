@@ -3,31 +3,55 @@ import sys
 from threading import Semaphore, Thread
 from traceback import format_exc
 
+from .redraw import RedrawDecoder, record as record_redraw
+
 
 class UIBridge(object):
 
     """UIBridge class. Connects a Nvim instance to a UI class."""
 
-    def connect(self, nvim, ui, profile=None, notify=False):
+    tracer = None
+    on_close = None
+    _record = None
+
+    def connect(self, nvim, ui, profile=None, notify=False,
+                single_loop=False, tracer=None, record=None):
         """Connect nvim and the ui.
 
         This will start loops for handling the UI and nvim events while
-        also synchronizing both.
+        also synchronizing both. If `single_loop` is True, the nvim session
+        is driven by the GLib main loop of the UI instead of a separate
+        thread. If `tracer` is a `LatencyTracer`, inputs are traced until the
+        redraw that follows them is applied. `profile` is an optional
+        `Profiler`, which covers both the nvim and UI threads. If `record`
+        is a path, the raw redraw notifications are appended to it.
         """
-        self._notify = notify
-        self._error = None
-        self._nvim = nvim
-        self._ui = ui
-        self._profile = profile
-        self._sem = Semaphore(0)
-        t = Thread(target=self._nvim_event_loop)
-        t.daemon = True
-        t.start()
+        if record:
+            self._record = open(record, 'ab')
+        self._start(nvim, ui, profile, notify, single_loop, tracer)
         self._ui_event_loop()
+        if self._record:
+            self._record.close()
+            self._record = None
         if self._error:
             print(self._error)
-        if self._profile:
-            print(self._profile)
+        if self._profile and self._profile.running:
+            self._profile.disable()
+            stats = self._profile.stop()
+            if stats:
+                print(stats)
+
+    def open(self, nvim, ui, single_loop=False, tracer=None, on_close=None):
+        """Connect nvim and a ui hosted by an already running UI event loop.
+
+        Like `connect`, but returns as soon as the ui opened. Must be called
+        from the UI thread. `on_close` is called with the bridge when the ui
+        closes after nvim exited.
+        """
+        self.on_close = on_close
+        self._start(nvim, ui, None, False, single_loop, tracer)
+        self._sem.acquire()
+        ui.open(self, self._on_close)
 
     def exit(self):
         """Disconnect by exiting nvim."""
@@ -36,6 +60,8 @@ class UIBridge(object):
 
     def input(self, input_str):
         """Send input to nvim."""
+        if self.tracer:
+            self.tracer.input_queued()
         self._call(self._nvim.input, input_str)
 
     def resize(self, columns, rows):
@@ -50,26 +76,75 @@ class UIBridge(object):
         """Detach the UI from nvim."""
         self._call(self._nvim.ui_detach)
 
+    def toggle_profile(self):
+        """Start or stop profiling, must be called from the UI thread.
+
+        Returns False if no profiler was configured.
+        """
+        profile = self._profile
+        if not profile:
+            return False
+        if not profile.running:
+            profile.start()
+            profile.enable()
+            self._call(profile.enable)
+            return True
+
+        def stop():
+            profile.disable()
+            stats = profile.stop()
+            if stats:
+                print(stats)
+
+        profile.disable()
+        # stop from the nvim thread, after it stopped profiling itself
+        self._call(stop)
+        return True
+
+    def _start(self, nvim, ui, profile, notify, single_loop, tracer):
+        self.tracer = tracer
+        self._notify = notify
+        self._error = None
+        self._nvim = nvim
+        self._ui = ui
+        self._profile = profile
+        self._sem = Semaphore(0)
+        self._driver = None
+        self._decoder = RedrawDecoder()
+        self._handlers = {}
+        if profile and not profile.paused:
+            profile.start()
+        if single_loop:
+            from .glib_loop import GLibSessionDriver
+            self._driver = GLibSessionDriver(nvim)
+            self._driver.start(self._nvim_event_loop)
+        else:
+            t = Thread(target=self._nvim_event_loop, name='nvim')
+            t.daemon = True
+            t.start()
+
+    def _on_close(self, ui):
+        if self._error:
+            print(self._error)
+        if self.on_close:
+            self.on_close(self)
+
     def _call(self, fn, *args):
-        self._nvim.session.threadsafe_call(fn, *args)
+        if self._driver:
+            self._driver.call(fn, *args)
+        else:
+            self._nvim.session.threadsafe_call(fn, *args)
 
     def _ui_event_loop(self):
         self._sem.acquire()
         if self._profile:
-            import StringIO
-            import cProfile
-            import pstats
-            pr = cProfile.Profile()
-            pr.enable()
+            self._profile.enable()
         self._ui.start(self)
-        if self._profile:
-            pr.disable()
-            s = StringIO.StringIO()
-            ps = pstats.Stats(pr, stream=s)
-            ps.strip_dirs().sort_stats(self._profile).print_stats(30)
-            self._profile = s.getvalue()
 
     def _nvim_event_loop(self):
+        if self._profile:
+            self._profile.enable()
+
         def on_setup():
             self._sem.release()
 
@@ -77,25 +152,32 @@ class UIBridge(object):
             raise Exception('Not implemented')
 
         def on_notification(method, updates):
+            if method != b'redraw' and method != 'redraw':
+                return
+            if self._record:
+                record_redraw(self._record, updates)
+            batch = self.tracer.redraw_received() if self.tracer else None
+            events = self._decoder.decode(updates)
+
             def apply_updates():
                 if self._notify:
                     sys.stdout.write('attached\n')
                     sys.stdout.flush()
                     self._notify = False
                 try:
-                    for update in updates:
-                        # import sys
-                        # l = [','.join([str(a) for a in args])
-                        #      for args in update[1:]]
-                        # print >> sys.stderr, update[0], ' '.join(l)
-                        handler = getattr(self._ui, '_nvim_' + update[0])
-                        for args in update[1:]:
+                    for name, calls in events:
+                        handler = self._handlers.get(name, None)
+                        if handler is None:
+                            handler = getattr(self._ui, name)
+                            self._handlers[name] = handler
+                        for args in calls:
                             handler(*args)
+                    if batch is not None:
+                        self.tracer.redraw_applied(batch)
                 except:
                     self._error = format_exc()
                     self._call(self._nvim.quit)
-            if method == 'redraw':
-                self._ui.schedule_screen_update(apply_updates)
+            self._ui.schedule_screen_update(apply_updates)
 
         self._nvim.session.run(on_request, on_notification, on_setup)
         self._ui.quit()
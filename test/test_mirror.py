@@ -0,0 +1,147 @@
+import json
+import os
+import socket
+import tempfile
+import time
+from threading import Event, Thread
+
+from neovim_gui.mirror import MirrorUI, MirrorViewer
+
+
+class Bridge(object):
+    tracer = None
+
+    def attach(self, columns, rows, rgb):
+        pass
+
+
+def redraw(mirror, *updates, **kwargs):
+    applied = kwargs.get('applied')
+
+    def apply_updates():
+        for update in updates:
+            handler = getattr(mirror, '_nvim_' + update[0])
+            for args in update[1:]:
+                handler(*args)
+        if applied:
+            applied()
+    mirror.schedule_screen_update(apply_updates)
+
+
+def connect(factory, path):
+    # the socket file exists before the mirror listens on it
+    deadline = time.time() + 5
+    while True:
+        try:
+            return factory(path)
+        except socket.error:
+            assert time.time() < deadline
+            time.sleep(0.01)
+
+
+def connect_socket(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        raise
+    return sock
+
+
+def wait_for(predicate, viewer=None):
+    deadline = time.time() + 10
+    while not predicate():
+        assert time.time() < deadline
+        if viewer:
+            assert viewer.process(0.1) is not None
+        else:
+            time.sleep(0.01)
+
+
+def start_mirror(columns, rows):
+    path = os.path.join(tempfile.mkdtemp(), 'mirror.sock')
+    mirror = MirrorUI(path, columns=columns, rows=rows)
+    t = Thread(target=mirror.start, args=(Bridge(),))
+    t.start()
+    return mirror, t, path
+
+
+def stop_mirror(mirror, t):
+    mirror.quit()
+    t.join()
+
+
+def test_headless_ignores_events_without_screen_changes():
+    mirror, t, path = start_mirror(10, 2)
+    try:
+        viewer = connect(MirrorViewer, path)
+        redraw(mirror,
+               ['resize', [10, 2]],
+               ['busy_start', []],
+               ['busy_stop', []],
+               ['mode_change', ['insert']],
+               ['mouse_on', []],
+               ['mouse_off', []],
+               ['bell', []],
+               ['visual_bell', []],
+               ['set_title', ['title']],
+               ['set_icon', ['icon']],
+               ['suspend', []],
+               ['cursor_goto', [1, 0]],
+               ['put', ['o'], ['k']])
+        wait_for(lambda: viewer.text() == ' ' * 10 + '\nok' + ' ' * 8,
+                 viewer)
+        viewer.close()
+    finally:
+        stop_mirror(mirror, t)
+
+
+def test_slow_viewer_gets_coalesced_damage():
+    columns, rows, batches = 200, 40, 60
+    mirror, t, path = start_mirror(columns, rows)
+    applied = Event()
+    count = [0]
+
+    def on_applied():
+        count[0] += 1
+        if count[0] == batches + 1:
+            applied.set()
+
+    try:
+        redraw(mirror, ['resize', [columns, rows]], applied=on_applied)
+        # a viewer that doesn't read anything until all batches were applied
+        sock = connect(connect_socket, path)
+        wait_for(lambda: mirror._viewers)
+        for batch in range(batches):
+            text = str(batch % 10)
+            updates = []
+            # leave the last row alone, so the changes are sent as damage
+            for row in range(rows - 1):
+                updates.append(['cursor_goto', [row, 0]])
+                updates.append(['put'] + [[text]] * columns)
+            redraw(mirror, *updates, applied=on_applied)
+        # the source isn't blocked by the viewer
+        assert applied.wait(30)
+        buf = b''
+        messages = []
+        expected = str((batches - 1) % 10) * columns
+        sock.settimeout(10)
+        while True:
+            data = sock.recv(65536)
+            assert data
+            buf += data
+            while b'\n' in buf:
+                line, buf = buf.split(b'\n', 1)
+                messages.append(json.loads(line.decode('utf-8')))
+            last = messages[-1] if messages else None
+            if (last and last['type'] == 'damage' and
+                    len(last['lines']) == rows - 1 and
+                    last['lines']['0'][0][2] == expected):
+                break
+        sock.close()
+        assert messages[0]['type'] == 'snapshot'
+        # the damage of batches sent while the viewer was busy was merged
+        assert len(messages) < batches
+    finally:
+        stop_mirror(mirror, t)
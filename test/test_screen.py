@@ -0,0 +1,100 @@
+import random
+
+from neovim_gui import screen as screen_module
+from neovim_gui.screen import Screen, diff_snapshots
+
+
+TEXTS = ['a', 'b', ' ', u'\u00e9', u'e\u0301', u'a\u0308\u0301', u'\u5b57']
+ATTRS = [
+    None,
+    {'bold': True},
+    {'foreground': 0xff0000, 'italic': True},
+    (('bold', True), ('foreground', 5),),
+    (('reverse', True),),
+]
+
+
+def cells(screen):
+    return [[screen.get_cell(row, col) for col in range(screen.columns)]
+            for row in range(screen.rows)]
+
+
+def random_screen(rng, columns=13, rows=7, base=None):
+    screen = Screen.from_snapshot(base) if base else Screen(columns, rows)
+    for _ in range(rng.randrange(0, 30)):
+        screen.cursor_goto(rng.randrange(screen.rows),
+                           rng.randrange(screen.columns - 1))
+        text = rng.choice(TEXTS)
+        attrs = rng.choice(ATTRS)
+        screen.put(text, attrs)
+        if text == u'\u5b57':
+            # the right half of double width glyphs is empty
+            screen.put('', attrs)
+    return screen
+
+
+def brute_force_diff(old, new):
+    old, new = cells(Screen.from_snapshot(old)), cells(
+        Screen.from_snapshot(new))
+    rv = []
+    for row, (a, b) in enumerate(zip(old, new)):
+        spans = []
+        start = None
+        for col in range(len(a) + 1):
+            changed = col < len(a) and a[col] != b[col]
+            if changed and start is None:
+                start = col
+            elif not changed and start is not None:
+                spans.append((start, col,))
+                start = None
+        if spans:
+            rv.append((row, spans,))
+    return rv
+
+
+def pure_python_diff(old, new):
+    numpy = screen_module.numpy
+    screen_module.numpy = None
+    try:
+        return diff_snapshots(old, new)
+    finally:
+        screen_module.numpy = numpy
+
+
+def test_snapshot_round_trip():
+    screen = Screen(6, 3)
+    screen.cursor_goto(0, 0)
+    screen.put(u'\u5b57', {'bold': True})
+    screen.put('', {'bold': True})
+    screen.put(u'e\u0301', (('foreground', 5), ('bold', True),))
+    screen.put('x', None)
+    screen.cursor_goto(2, 4)
+    screen.put(u'a\u0308\u0301', {'foreground': 0xff0000, 'italic': True})
+    restored = Screen.from_snapshot(screen.snapshot())
+    assert (restored.columns, restored.rows) == (6, 3)
+    assert (restored.row, restored.col) == (2, 5)
+    assert cells(restored) == cells(screen)
+    assert restored.get_cell(0, 1) == ('', {'bold': True})
+    assert restored.get_cell(0, 2) == (u'e\u0301',
+                                       (('foreground', 5), ('bold', True),))
+    assert restored.snapshot() == screen.snapshot()
+
+
+def test_diff_paths_agree():
+    rng = random.Random(42)
+    for _ in range(200):
+        old = random_screen(rng).snapshot()
+        new = random_screen(rng, base=old).snapshot()
+        expected = brute_force_diff(old, new)
+        assert pure_python_diff(old, new) == expected
+        if screen_module.numpy is not None:
+            assert diff_snapshots(old, new) == expected
+
+
+def test_diff_of_equal_screens_is_empty():
+    rng = random.Random(1)
+    snapshot = random_screen(rng).snapshot()
+    # rebuilt screens have different highlight and string ids
+    rebuilt = Screen.from_snapshot(snapshot).snapshot()
+    assert diff_snapshots(snapshot, rebuilt) == []
+    assert pure_python_diff(snapshot, rebuilt) == []